@@ -1,19 +1,111 @@
+import bisect
+import mmap
+import os
 import random
-from math import sqrt, log
+import struct
+import time
+from array import array
+from collections import OrderedDict
+from copy import copy
+from math import sqrt, log, ceil
+from multiprocessing import Pool, current_process
+from operator import mul
 from types import NoneType
 
-from GameBoard import GameState
-from utils import MAX_DEPTH, DEBUG_EXPECTIMAX, roll_die
+from GameBoard import GameState, MOVE_TABLE, NUM_CODES, NUM_PLANES, POS_TYPES, TOTAL_STEPS, PLANE_POS, HANGAR, FINISH, \
+    PLANE_CATEGORY, MOVABLE, play_move, pack_state, unpack_components
+from utils import MAX_DEPTH, MOVE_TIME_LIMIT, MAX_ITERATIVE_DEPTH, TT_MAX_ENTRIES, DEBUG_EXPECTIMAX, \
+    MCTS_ITERATIONS, MCTS_WORKERS, MCTS_PARALLEL, MCTS_ROLLOUT_PLIES, MCTS_ROLLOUT_POLICY, Q_MAX_ENTRIES, \
+    FRONTIER_DEPTH, STACK_BLOCKS, EXPECTIMAX_OPPONENTS, MCTS_MAX_FREE_NODES
+import numpy as np
 from typing_extensions import Self
 
+from Instrumentation import clock
+from OpeningBook import get_opening_book
+from Tablebase import get_tablebase
+
+# Transposition table entry types
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+def plane_score(color: str, code: int) -> float:
+    """
+    Score of one plane in AeroplaneChessAgent.evaluate_state
+    """
+    score = 0
+    if code == FINISH:
+        score += 100
+    elif code == HANGAR:
+        score -= 50
+    if POS_TYPES[code] == 'Final':
+        score += 50 * 0.05 + (6 - PLANE_POS[color][code]) * 0.05
+    else:
+        score += TOTAL_STEPS[code] * 0.05
+    return score
+
+
+PLANE_SCORES = {color: tuple(plane_score(color, code) for code in range(NUM_CODES)) for color in MOVE_TABLE}
+# Largest score a single move can lose for the moving plane (moving forward on the final stretch)
+MAX_MOVE_LOSS = max(PLANE_SCORES[color][code] - PLANE_SCORES[color][move[0]]
+                    for color in MOVE_TABLE for code in range(NUM_CODES) for move in MOVE_TABLE[color][code]
+                    if move is not None)
+_max_gains = {}
+
+
+def max_gains(color: str, moves: int) -> tuple[float, ...]:
+    """
+    Highest score gain of a plane on each code after moving it at most `moves` times
+    """
+    if (color, moves) not in _max_gains:
+        scores = PLANE_SCORES[color]
+        best = scores
+        for _ in range(moves):
+            best = tuple(max([best[code]] + [best[move[0]] for move in MOVE_TABLE[color][code] if move is not None])
+                         for code in range(NUM_CODES))
+        _max_gains[(color, moves)] = tuple(best[code] - scores[code] for code in range(NUM_CODES))
+    return _max_gains[(color, moves)]
+
 
 class AeroplaneChessAgent:
+    hook = None  # DecisionHook receiving the DecisionStats of every move, instrumentation is skipped without it
+    use_book = True  # Whether searching agents play early-game decisions from the opening book
+
     def __init__(self, color: str):
         self.color = color
+        self.stats = None  # DecisionStats of the move being decided, only while a hook is set
 
     def get_action(self, state: GameState, die_v: int):
         NotImplementedError("Abstract Method")
 
+    def params(self) -> dict:
+        """
+        Constructor parameters the agent plays with, as keyword arguments that rebuild it (recorded with its games)
+        """
+        return {}
+
+    def endgame_action(self, state: GameState, die_v: int):
+        """
+        Action with the highest win probability in the endgame table, None if state is not in the table
+        """
+        tablebase = get_tablebase()
+        if tablebase is None or tablebase.index(state) is None:
+            return None
+        moves = state.get_distinct_moves(die_v)
+        if len(moves) == 0:
+            return None
+        return max(moves, key=lambda a: tablebase.win_probability(state.generate_successor(a, die_v), self.color))
+
+    def book_action(self, state: GameState, die_v: int):
+        """
+        Action of the opening book, None if the decision is not in the book or the agent doesn't use it
+        """
+        book = get_opening_book() if self.use_book else None
+        if book is None:
+            return None
+        return book.action(state, die_v)
+
     def evaluate_state(self, state: GameState):
         """
         Finished plane: 100
@@ -42,6 +134,75 @@ class AeroplaneChessAgent:
 
         return score
 
+    @staticmethod
+    def evaluate(state: GameState) -> float:
+        """
+        evaluate_state from the score components carried by state, in units of one step (0.05)
+        """
+        units = 0
+        for components in state.components:
+            finished, hangar, steps, final_distance = unpack_components(components)
+            units += 2000 * finished - 1000 * hangar + steps + final_distance
+        return units * 0.05
+
+    @staticmethod
+    def evaluate_against(state: GameState, color: str) -> float:
+        """
+        evaluate from the side of color: the score of its planes minus the other players', whose moves against it
+        lower the value
+        """
+        units = 0
+        for player_color, components in zip(state.colors, state.components):
+            finished, hangar, steps, final_distance = unpack_components(components)
+            score = 2000 * finished - 1000 * hangar + steps + final_distance
+            units += score if player_color == color else -score
+        return units * 0.05
+
+    @staticmethod
+    def evaluate_planes(planes: list[int], colors: tuple[str, ...]) -> float:
+        """
+        evaluate_state of packed planes
+        """
+        return sum(PLANE_SCORES[colors[i // NUM_PLANES]][code] for i, code in enumerate(planes))
+
+    @staticmethod
+    def evaluation_bounds(state: GameState, moves: int, die_v: int = None):
+        """
+        Lowest and highest evaluate_state score after at most `moves` moves from state, the first one with die_v if given:
+        * Gain: only moving planes gain, at most `moves` planes each with its best gain
+        * Loss: any plane can be caught back to hangar (-50), and each move loses at most MAX_MOVE_LOSS
+        """
+        score = 0
+        loss = moves * MAX_MOVE_LOSS
+        for i, code in enumerate(state.planes):
+            color = state.colors[i // NUM_PLANES]
+            score += PLANE_SCORES[color][code]
+            if code != FINISH:
+                loss += PLANE_SCORES[color][code] + 50
+        if moves == 0:
+            return score, score
+
+        if die_v is None:
+            gains = [max_gains(state.colors[i // NUM_PLANES], moves)[code] for i, code in enumerate(state.planes)]
+            gains.sort(reverse=True)
+            return score - loss, score + sum(gains[:moves])
+
+        # Best first move with die_v, then the best gains of the remaining moves
+        color = state.colors[state.turn]
+        scores = PLANE_SCORES[color]
+        first_gain = None
+        for code in state.planes[state.turn * NUM_PLANES:(state.turn + 1) * NUM_PLANES]:
+            move = MOVE_TABLE[color][code][die_v]
+            if move is not None:
+                gain = scores[move[0]] - scores[code] + max_gains(color, moves - 1)[move[0]]
+                if first_gain is None or gain > first_gain:
+                    first_gain = gain
+        if first_gain is None:  # No movable plane, the state is evaluated as it is
+            return score, score
+        gains = [max_gains(state.colors[i // NUM_PLANES], moves - 1)[code] for i, code in enumerate(state.planes)]
+        gains.sort(reverse=True)
+        return score - loss, score + first_gain + sum(gains[:moves - 1])
+
     def __repr__(self):
         return "Abstract agent"
 
@@ -60,104 +221,372 @@ class RandomAgent(AeroplaneChessAgent):
         return f"Random agent ({self.color})"
 
 
+class TranspositionTable:
+    """
+    Bounded cache of search results keyed by (zobrist hash, die, depth remaining, is max node),
+    the least recently used entry is evicted when the table is full
+    """
+
+    def __init__(self, max_entries: int = TT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
 class ExpectimaxAgent(AeroplaneChessAgent):
-    def __init__(self, color: str):
+    """
+    Expectimax over max (agent) nodes and chance nodes (die rolls and the opponents' uniformly random moves),
+    chance nodes are pruned with Star1/Star2 using the evaluation bounds. With opponents='paranoid' every opponent
+    move is a min node instead, as if all the other players played together against the agent, and leaves are
+    scored with evaluate_against the agent.
+    """
+
+    def __init__(self, color: str, max_entries: int = TT_MAX_ENTRIES, pruning: bool = True,
+                 time_limit: float = MOVE_TIME_LIMIT, frontier_depth: int = FRONTIER_DEPTH, evaluator=None,
+                 depth: int = MAX_DEPTH, opponents: str = EXPECTIMAX_OPPONENTS):
         super().__init__(color)
+        self.table = TranspositionTable(max_entries)
+        # Star1/Star2 bounds hold for evaluate only, a custom evaluator or paranoid leaves (evaluate_against) search
+        # chance nodes without pruning
+        self.paranoid = opponents == 'paranoid'
+        self.pruning = pruning and evaluator is None and not self.paranoid
+        self.time_limit = time_limit
+        self.depth = depth  # Search depth without a time limit
+        # Leaves are scored by evaluator (a vector evaluator such as Frontier.LinearEvaluator, the default gives the
+        # values of evaluate), subtrees of at most frontier_depth moves are searched by a Frontier.FrontierSearch
+        self.frontier_depth = 0 if STACK_BLOCKS else frontier_depth
+        self.evaluator = evaluator
+        self.frontiers = {}  # colors -> FrontierSearch
+        self.max_depth = depth  # Depth of the current search
+        self.deadline = None
+        self.nodes = 0
+        self.root_values = {}  # Root action values of the last completed iteration, used to order moves
 
-    def get_action(self, state: GameState, die_v: int):
+    def params(self) -> dict:
+        # A custom evaluator is not recorded, its agent searches without pruning
+        return {'depth': self.depth, 'time_limit': self.time_limit, 'pruning': self.pruning,
+                'frontier_depth': self.frontier_depth, 'opponents': 'paranoid' if self.paranoid else 'random',
+                'max_entries': self.table.max_entries}
+
+    def get_action(self, state: GameState, die_v: int, deadline: float = None):
+        """
+        Without a deadline (time.monotonic() timestamp) or time limit search to depth, otherwise deepen the search
+        until the deadline and return the best action of the deepest completed search
+        """
         movable_planes_inx = state.get_movable_planes(die_v)
+        action = self.book_action(state, die_v)
+        if action is None:
+            action = self.endgame_action(state, die_v)
+        if action is not None:
+            return action
         if len(movable_planes_inx) > 0:
-            v, action = self._max(state, die_v, 1)
+            if DEBUG_EXPECTIMAX:
+                before = GameState(state._players, state.turn, state.planes)
+            if deadline is None and self.time_limit is not None:
+                deadline = time.monotonic() + self.time_limit
+            if deadline is None:
+                self.max_depth = self.depth
+                self.root_values = {}
+                v, action = self._search(state, die_v, 1, True, -float('inf'), float('inf'))
+            else:
+                action = self._iterative_deepening(state, die_v, movable_planes_inx, deadline)
 
             if DEBUG_EXPECTIMAX:
-                try:
-                    v, action = self._max(state, die_v, 1)
-                    # As long as there is plane to move, it's impossible action is None
-                    assert action is not None
-                except Exception:
-                    print("HERE")
-                    v, action = self._max(state, die_v, 1)  # Debug
+                # As long as there is plane to move, it's impossible action is None
+                assert action is not None
+                # Every move applied by the search was undone
+                assert (state.turn, state.planes, state.zobrist, state.components, state.occupancy) == \
+                       (before.turn, before.planes, before.zobrist, before.components, before.occupancy)
             return action
         return None
 
-    def _max(self, state, die_v, depth):
+    def _iterative_deepening(self, state, die_v, movable_planes_inx, deadline):
+        action = movable_planes_inx[0]
+        self.root_values = {}
+        self.deadline = deadline
+        prev_time = None
+        try:
+            for depth in range(1, MAX_ITERATIVE_DEPTH + 1):
+                start = time.monotonic()
+                self.max_depth = depth
+                root_values = self.root_values
+                self.root_values = {}
+                try:
+                    v, action = self._search(state, die_v, 1, True, -float('inf'), float('inf'))
+                except SearchTimeout:
+                    self.root_values = root_values
+                    break
+                # Skip the next iteration if it's not expected to finish before the deadline
+                iter_time = time.monotonic() - start
+                growth = iter_time / prev_time if prev_time else 6
+                if time.monotonic() + iter_time * growth > deadline:
+                    break
+                prev_time = max(iter_time, 1e-6)
+        finally:
+            self.deadline = None
+        return action
+
+    def _search(self, state, die_v, depth, is_max, alpha, beta):
+        """
+        Value of state for the player to move with die_v, is_max tells if it's the agent's (max) or an opponent's turn.
+        Values outside (alpha, beta) are bounds: v <= alpha is an upper bound, v >= beta a lower bound.
+        """
+        if self.deadline is not None:
+            self.nodes += 1
+            if self.nodes % 64 == 0 and time.monotonic() > self.deadline:
+                raise SearchTimeout()
+
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+            stats.max_depth = max(stats.max_depth, depth)
+            stats.cache_lookups += 1
+
+        key = (state.zobrist, die_v, self.max_depth - depth, is_max)
+        entry = self.table.get(key)
+        if entry is not None:
+            if stats is not None:
+                stats.cache_hits += 1
+            v, move_code, bound = entry
+            if bound == EXACT or (bound == LOWER and v >= beta) or (bound == UPPER and v <= alpha):
+                return v, self._plane_at(state, move_code)
+
         movable_planes_inx = state.get_movable_planes(die_v)
-        if state.is_win(self.color) or state.is_lose(self.color) or depth > MAX_DEPTH or len(movable_planes_inx) == 0:
-            return self.evaluate_state(state), None
+        if state.is_win(self.color) or state.is_lose(self.color) or depth > self.max_depth or len(movable_planes_inx) == 0:
+            v, move = self._leaf_value(state), None
+            if stats is not None:
+                stats.leaves += 1
+        elif is_max:
+            # Equivalent moves lead to states of the same value, search one of each
+            moves = self._order(key, state, state.get_distinct_moves(die_v), depth)
+            v, move = self._max(state, die_v, depth, moves, alpha, beta)
+        else:
+            v, move = self._min(state, die_v, depth, alpha, beta)
+
+        bound = UPPER if v <= alpha else LOWER if v >= beta else EXACT
+        # States differing only in the order of a player's planes share the entry, the move is kept as the position
+        # of the plane moved
+        self.table.put(key, (v, None if move is None else state.planes[state.turn * NUM_PLANES + move], bound))
+        return v, move
+
+    def _leaf_value(self, state):
+        if self.evaluator is None:
+            return self.evaluate_against(state, self.color) if self.paranoid else self.evaluate(state)
+        codes = np.array(state.planes, dtype=np.int64).reshape(1, len(state.colors), NUM_PLANES)
+        return float(self.evaluator(codes)[0])
+
+    @staticmethod
+    def _plane_at(state, code):
+        """
+        First plane of the player to move at code
+        """
+        if code is None:
+            return None
+        start = state.turn * NUM_PLANES
+        return state.planes.index(code, start, start + NUM_PLANES) - start
+
+    def _max(self, state, die_v, depth, movable_planes_inx, alpha, beta):
         move = None
         v = -float('inf')
 
         for a in movable_planes_inx:
-            expected_v2 = 0
-            new_state = state.generate_successor(a, die_v)
-            # When die is 6, the next will still be max player
-            for die_v2 in range(1, 7):
-                if die_v == 6:
-                    v2, _ = self._max(new_state, die_v2, depth + 1)
-
-                    if DEBUG_EXPECTIMAX:
-                        try:
-                            assert v2 != -float('inf')
-                        except Exception:
-                            print("HERE")
-                            v2, _ = self._max(new_state, die_v2, depth + 1)
-                else:
-                    v2, _ = self._min(new_state, die_v2, depth + 1)
-
-                    if DEBUG_EXPECTIMAX:
-                        try:
-                            assert v2 != -float('inf')
-                        except Exception:
-                            print("HERE")
-                            v2, _ = self._min(new_state, die_v2, depth + 1)
-                expected_v2 += v2
-            expected_v2 /= 6
+            # Moves are searched on state in place and undone, also when the search times out
+            record = state.apply(a, die_v)
+            try:
+                # When die is 6, the next will still be max player
+                expected_v2 = self._roll(state, depth + 1, state.colors[state.turn] == self.color, max(alpha, v), beta)
+            finally:
+                state.undo(record)
+            if depth == 1:
+                self.root_values[a] = expected_v2
             if expected_v2 > v:
                 v, move = expected_v2, a
+                if v >= beta:
+                    break
         return v, move
 
-    def _min(self, state, die_v, depth):
-        movable_planes_inx = state.get_movable_planes(die_v)
-        if state.is_win(self.color) or state.is_lose(self.color) or depth > MAX_DEPTH or len(movable_planes_inx) == 0:
-            return self.evaluate_state(state), None
+    def _order(self, key, state, movable_planes_inx, depth):
+        """
+        Search first the best actions of the previous iteration: root action values, or the best move of the
+        transposition table entry one depth shallower
+        """
+        if depth == 1 and self.root_values:
+            return sorted(movable_planes_inx, key=lambda a: -self.root_values.get(a, -float('inf')))
+        entry = self.table.entries.get((key[0], key[1], key[2] - 1, key[3]))
+        if entry is not None and entry[1] is not None:
+            best = self._plane_at(state, entry[1])
+            if best in movable_planes_inx and best != movable_planes_inx[0]:
+                return [best] + [a for a in movable_planes_inx if a != best]
+        return movable_planes_inx
+
+    def _min(self, state, die_v, depth, alpha, beta):
+        # The opponent moves uniformly at random, so it's a chance node over its movable planes. Planes sharing a
+        # position lead to the same state, each distinct move is searched once weighted by its number of planes.
+        # The player moving next is the agent or another opponent, the same one when die is 6.
+        moves = state.get_distinct_moves(die_v)
+        if self.paranoid:
+            return self._paranoid_min(state, die_v, depth, moves, alpha, beta)
+        n = len(moves)
+        lo, hi = self.evaluation_bounds(state, self.max_depth - depth + 1, die_v) if self.pruning else (None, None)
+
+        def search(i, alpha2, beta2):
+            record = state.apply(moves[i], die_v)
+            try:
+                return self._roll(state, depth + 1, state.colors[state.turn] == self.color, alpha2, beta2)
+            finally:
+                state.undo(record)
+
+        return self._expect(search, alpha, beta, [lo] * n, [hi] * n, state.get_move_weights(die_v)), None
+
+    def _paranoid_min(self, state, die_v, depth, moves, alpha, beta):
         move = None
-        expected_v = 0
+        v = float('inf')
+        for a in moves:
+            record = state.apply(a, die_v)
+            try:
+                v2 = self._roll(state, depth + 1, state.colors[state.turn] == self.color, alpha, min(beta, v))
+            finally:
+                state.undo(record)
+            if v2 < v:
+                v, move = v2, a
+                if v <= alpha:
+                    break
+        return v, move
 
-        for a in movable_planes_inx:
-            expected_v2 = 0
-            new_state = state.generate_successor(a, die_v)
-            for die_v2 in range(1, 7):
-                # When die is 6, the next will still be min player
-                if die_v == 6:
-                    v2, a2 = self._min(new_state, die_v2, depth + 1)
-
-                    if DEBUG_EXPECTIMAX:
-                        try:
-                            assert v2 != -float('inf')
-                        except Exception:
-                            print("HERE")
-                            v2, a2 = self._min(new_state, die_v2, depth + 1)
-                else:
-                    v2, a2 = self._max(new_state, die_v2, depth + 1)
-
-                    if DEBUG_EXPECTIMAX:  # Use for debug mode
-                        try:
-                            assert v2 != -float('inf')
-                        except Exception:
-                            print("HERE")
-                            v2, a2 = self._max(new_state, die_v2, depth + 1)
-                expected_v2 += v2
-            expected_v2 /= 6
-            expected_v += expected_v2
-        if len(movable_planes_inx) > 0:
-            expected_v /= len(movable_planes_inx)
-        return expected_v, move
+    def _roll(self, state, depth, is_max, alpha, beta):
+        """
+        Chance node over the die roll of the player to move in state, equivalent rolls are searched once
+        """
+        moves = max(self.max_depth - depth + 1, 0)
+        if 0 < moves <= self.frontier_depth:
+            return self._frontier_value(state, moves)
+        outcomes = state.get_chance_outcomes()
+        weights = [weight for _, weight in outcomes]
+        if self.pruning:
+            bounds = [self.evaluation_bounds(state, moves, die_v2) for die_v2, _ in outcomes]
+            lower_bounds = [lo for lo, _ in bounds]
+            upper_bounds = [hi for _, hi in bounds]
+        else:
+            lower_bounds = upper_bounds = None  # Unused by _expect
+
+        def search(i, alpha2, beta2):
+            v2, _ = self._search(state, outcomes[i][0], depth, is_max, alpha2, beta2)
+            return v2
+
+        if is_max and self.pruning and 6 * beta < sum(map(mul, weights, upper_bounds)):
+            v = self._probe(state, depth, beta, outcomes, weights, lower_bounds, upper_bounds)
+            if v is not None:  # Probing cut off the node
+                return v
+        return self._expect(search, alpha, beta, lower_bounds, upper_bounds, weights)
+
+    def _frontier_value(self, state, moves):
+        """
+        Value of the whole subtree of _roll in one batch
+        """
+        frontier = self.frontiers.get(state.colors)
+        if frontier is None:
+            # Imported here as Frontier uses BatchGame, which imports this module
+            from Frontier import FrontierSearch
+            frontier = FrontierSearch(state.colors, self.color, self.evaluator, self.paranoid)
+            self.frontiers[state.colors] = frontier
+        leaves = frontier.leaves
+        v = frontier.value(state, moves)
+        if self.stats is not None:
+            self.stats.leaves += frontier.leaves - leaves
+        return v
+
+    def _probe(self, state, depth, beta, outcomes, weights, lower_bounds, upper_bounds):
+        """
+        Star2 probing: the first action of each max child is a lower bound of that child. Raise lower_bounds with
+        the probed values, return the node value bound if they alone reach beta.
+        """
+        for i, (die_v2, weight) in enumerate(outcomes):
+            movable_planes_inx = state.get_movable_planes(die_v2)
+            if state.is_win(self.color) or state.is_lose(self.color) or depth > self.max_depth or \
+                    len(movable_planes_inx) == 0:
+                continue
+            others = sum(map(mul, weights, lower_bounds)) - weight * lower_bounds[i]
+            beta2 = (6 * beta - others) / weight
+            record = state.apply(movable_planes_inx[0], die_v2)
+            try:
+                v2 = self._roll(state, depth + 1, state.colors[state.turn] == self.color, lower_bounds[i],
+                                min(upper_bounds[i], beta2))
+            finally:
+                state.undo(record)
+            lower_bounds[i] = max(lower_bounds[i], v2)
+            if v2 >= beta2:
+                return max((others + weight * lower_bounds[i]) / 6, beta)
+        return None
+
+    def _expect(self, search, alpha, beta, lower_bounds, upper_bounds, weights):
+        """
+        Star1 pruning over children bounded by lower_bounds and upper_bounds, child i has probability
+        weights[i] / sum(weights). search(i, alpha, beta) returns the value of child i
+        """
+        n = sum(weights)
+        expected_v = 0  # Weighted sum of the searched children
+        if not self.pruning:
+            for i, w in enumerate(weights):
+                expected_v += w * search(i, -float('inf'), float('inf'))
+            return expected_v / n
+
+        remaining_lo = sum(map(mul, weights, lower_bounds))
+        remaining_hi = sum(map(mul, weights, upper_bounds))
+        for i, w in enumerate(weights):
+            remaining_lo -= w * lower_bounds[i]
+            remaining_hi -= w * upper_bounds[i]
+            alpha2 = (n * alpha - expected_v - remaining_hi) / w
+            beta2 = (n * beta - expected_v - remaining_lo) / w
+            v2 = search(i, max(lower_bounds[i], alpha2), min(upper_bounds[i], beta2))
+            expected_v += w * v2
+            if v2 <= alpha2:  # Can't be better than alpha
+                return min((expected_v + remaining_hi) / n, alpha)
+            if v2 >= beta2:  # Already as good as beta
+                return max((expected_v + remaining_lo) / n, beta)
+        return expected_v / n
 
     def __repr__(self):
         return f"Expectimax agent ({self.color})"
 
 
 class MCTSNode:
+    """
+    Decision node (state with its die roll) whose children are the chance nodes of its moves, or chance node (state
+    before the die roll, reached by action) whose children are the decision nodes of the die rolls drawn so far
+    """
+    __slots__ = ('state', 'n', 'u', 'action', 'parent', 'children')
+
     def __init__(self, state: GameState, parent: [Self, NoneType], action: int = None):
         self.state = state
         self.n = 1
@@ -168,71 +597,268 @@ class MCTSNode:
 
     def fully_expanded(self):
         """
-        A node is fully expanded if:
+        A decision node is fully expanded if:
         * It has multiple movable planes, then # children = movable planes
         * It doesn't have any movable plane, then should have one child
         """
-        movable_plane_inx = self.state.get_turn_player().get_movable_planes(self.state.die_roll)
+        movable_plane_inx = self.state.get_distinct_moves(self.state.die_roll)
         if len(movable_plane_inx) > 0:
             return len(self.children) == len(movable_plane_inx)
         else:
             return len(self.children) == 1
 
 
+class MCTSNodePool:
+    """
+    Free list of released MCTS nodes, reused instead of allocating new nodes
+    """
+
+    def __init__(self, max_free: int = MCTS_MAX_FREE_NODES):
+        self.max_free = max_free
+        self.free = []
+
+    def acquire(self, state: GameState, parent: [MCTSNode, NoneType], action: int = None) -> MCTSNode:
+        if len(self.free) == 0:
+            return MCTSNode(state, parent, action)
+        node = self.free.pop()
+        node.state = state
+        node.n = 1
+        node.u = 0
+        node.action = action
+        node.parent = parent
+        return node
+
+    def release(self, node: MCTSNode):
+        """
+        Release node and its whole subtree
+        """
+        stack = [node]
+        while len(stack) > 0:
+            node = stack.pop()
+            stack.extend(node.children)
+            node.children.clear()
+            node.state = None
+            node.parent = None
+            if len(self.free) < self.max_free:
+                self.free.append(node)
+
+
 class MCTSAgent(AeroplaneChessAgent):
-    def __init__(self, color: str):
+    def __init__(self, color: str, iterations: int = MCTS_ITERATIONS, workers: int = MCTS_WORKERS,
+                 parallel: str = MCTS_PARALLEL, rollout_plies: [NoneType, int] = MCTS_ROLLOUT_PLIES,
+                 rollout_policy: str = MCTS_ROLLOUT_POLICY, max_free_nodes: int = MCTS_MAX_FREE_NODES):
         super().__init__(color)
+        self.rollout_plies = rollout_plies
+        self.rollout_policy = rollout_policy
         self.root = None
+        self.iterations = iterations
+        self.workers = workers
+        self.parallel = parallel
+        self._pool = None
+        self.nodes = MCTSNodePool(max_free_nodes)
+        self.last_action = None  # Action played from root, the tree is reused on the next move
 
-    def get_action(self, state: GameState, die_v: int):
+    def params(self) -> dict:
+        return {'iterations': self.iterations, 'workers': self.workers, 'parallel': self.parallel,
+                'rollout_plies': self.rollout_plies, 'rollout_policy': self.rollout_policy,
+                'max_free_nodes': self.nodes.max_free}
+
+    def get_action(self, state: GameState, die_v: int, deadline: float = None):
         """
-        Start new root for each state or search?
+        Search from the tree of the last move, for the agent's iterations or until the deadline
+        (time.monotonic() timestamp) if given
         """
         movable_planes_inx = state.get_movable_planes(die_v)
+        action = self.book_action(state, die_v)
+        if action is None:
+            action = self.endgame_action(state, die_v)
+        if action is not None:
+            self.release_tree()
+            return action
 
         if len(movable_planes_inx) > 0:
-            self.root = MCTSNode(state, parent=None)
+            if state.die_roll != die_v:
+                # The root is the decision node of die_v
+                state = copy(state)
+                state.die_roll = die_v
+            # Pool workers are daemons and can't start their own workers
+            if self.workers > 1 and not current_process().daemon:
+                if self._pool is None:
+                    self._pool = Pool(self.workers)
+                if self.parallel == 'root':
+                    self.release_tree()
+                    stats = self._root_parallel_search(state, deadline)
+                else:
+                    stats = self._search(state, self._pool, deadline=deadline)
+            else:
+                stats = self._search(state, deadline=deadline)
 
-            for i in range(200):
-                # print("Iteration:", i)
-                leaf = self.select()
-                if leaf.state.is_win(self.color) or leaf.state.is_lose(self.color):
-                    break
+            # Action with the highest total value
+            action = max(stats, key=lambda a: stats[a][1])
+            assert action is not None
+            self.last_action = action
+            return action
+        return None
 
-                child = self.expand(leaf)
+    def reuse_tree(self, state: GameState) -> MCTSNode:
+        """
+        Continue from the node of the last search tree matching state, reached by the action played and the following
+        die rolls (chance nodes) and moves. Nodes match by Zobrist hash and die, in any order of the players' planes
+        (the tree moves the first of planes sharing a position, the game may move another). Release the rest of the
+        tree.
+        """
+        new_root = None
+        if self.root is not None:
+            # Breadth first from the child of the action played, the closest match has the most statistics
+            frontier = [child for child in self.root.children if child.action == self.last_action]
+            while len(frontier) > 0 and new_root is None:
+                for node in frontier:
+                    if node.state.zobrist == state.zobrist and node.state.die_roll == state.die_roll:
+                        new_root = node
+                        break
+                frontier = [child for node in frontier for child in node.children]
+
+        if self.stats is not None:
+            self.stats.cache_lookups += 1
+            self.stats.cache_hits += new_root is not None
+        if new_root is None:
+            self.release_tree()
+            return self.nodes.acquire(state, parent=None)
+        # Detach the new root before releasing the old tree
+        new_root.parent.children.remove(new_root)
+        new_root.parent = None
+        self.nodes.release(self.root)
+        if new_root.state.planes != state.planes:
+            # Number the root moves as get_distinct_moves of state: the first plane at the code of the plane moved
+            start = state.turn * NUM_PLANES
+            for child in new_root.children:
+                if child.action is not None:
+                    code = new_root.state.planes[start + child.action]
+                    child.action = state.planes.index(code, start, start + NUM_PLANES) - start
+        new_root.state = state
+        return new_root
+
+    def release_tree(self):
+        if self.root is not None:
+            self.nodes.release(self.root)
+            self.root = None
+
+    def _search(self, state: GameState, pool: Pool = None, iterations: int = None, deadline: float = None):
+        """
+        Run MCTS from state, with a pool the rollouts of each new leaf are run on every worker. Stop after iterations
+        or at the deadline, once the root has a child. Return visits and total value of each root action.
+        """
+        stats = self.stats
+        self.root = self.reuse_tree(state)
+        iterations = self.iterations if iterations is None else iterations
+        if pool is not None:
+            iterations = ceil(iterations / self.workers)
 
+        for i in range(iterations):
+            if deadline is not None and len(self.root.children) > 0 and time.monotonic() > deadline:
+                break
+            start = clock() if stats is not None else None
+            leaf, die_roll = self.select()
+            if leaf.state.is_win(self.color) or leaf.state.is_lose(self.color):
+                break
+
+            if stats is not None:
+                t = clock()
+                stats.add_phase('select', t - start)
+                start = t
+            child = self.expand(leaf, die_roll)
+            if stats is not None:
+                t = clock()
+                stats.add_phase('expand', t - start)
+                start = t
+                stats.nodes += 1
+
+            if pool is None:
                 result = self.simulate(child)
-                self.backpropagate(result, child)
+            else:
+                tasks = [(self, child.state, random.getrandbits(32)) for _ in range(self.workers)]
+                results = pool.map(_rollout_task, tasks)
+                result = sum(results) / len(results)
+            if stats is not None:
+                t = clock()
+                stats.add_phase('simulate', t - start)
+                start = t
+                stats.leaves += 1 if pool is None else self.workers
+            self.backpropagate(result, child)
+            if stats is not None:
+                stats.add_phase('backpropagate', clock() - start)
 
-            best_child: MCTSNode = max(self.root.children, key=lambda x: x.u)
-            action = best_child.action
-            assert action is not None
-            return action
-        return None
+        return {child.action: (child.n, child.u) for child in self.root.children}
+
+    def _root_parallel_search(self, state: GameState, deadline: float = None):
+        """
+        Search independent trees on the workers and merge their root action statistics
+        """
+        iterations = [self.iterations // self.workers + (i < self.iterations % self.workers)
+                      for i in range(self.workers)]
+        tasks = [(self, state, n, random.getrandbits(32), deadline) for n in iterations]
+        stats = {}
+        for tree_stats in self._pool.map(_search_task, tasks):
+            for a, (n, u) in tree_stats.items():
+                n0, u0 = stats.get(a, (0, 0))
+                stats[a] = (n0 + n, u0 + u)
+        return stats
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def __getstate__(self):
+        # Trees and pools stay in the process that built them
+        return {**self.__dict__, 'root': None, '_pool': None, 'nodes': MCTSNodePool(self.nodes.max_free), 'stats': None}
 
-    def select(self) -> Self:
+    def select(self) -> tuple[MCTSNode, [NoneType, int]]:
         """
-        Repetitively select node using selection policy until leaf is reached
+        Repetitively select node using selection policy until leaf is reached: at decision nodes the child with the
+        best UCB1, at chance nodes the child of a die rolled at random. Return the leaf and, for a chance node leaf,
+        the die roll whose child is missing.
         """
         node = self.root
         node.n += 1
-        while node.fully_expanded() and len(node.children) > 0:
-            node = max(node.children, key=lambda x: self.UCB1(x))
+        depth = 1
+        while True:
+            if node.state.die_roll is None:
+                die_roll = random.randint(1, 6)
+                child = next((child for child in node.children if child.state.die_roll == die_roll), None)
+                if child is None:
+                    break
+            else:
+                die_roll = None
+                if not node.fully_expanded() or len(node.children) == 0:
+                    break
+                child = max(node.children, key=lambda x: self.UCB1(x))
+            node = child
             node.n += 1
-        return node
+            depth += 1
+        if self.stats is not None:
+            # The new child is expanded one level below
+            self.stats.max_depth = max(self.stats.max_depth, depth + 1)
+        return node, die_roll
 
-    @staticmethod
-    def expand(leaf: MCTSNode) -> MCTSNode:
+    def expand(self, leaf: MCTSNode, die_roll: [NoneType, int] = None) -> MCTSNode:
         """
-        Generate random successor state as new child
+        Add a new child to leaf: the chance node of an untried move of a decision node, or the decision node of
+        die_roll of a chance node
         """
+        state = leaf.state
+        if state.die_roll is None:
+            new_state = copy(state)
+            new_state.die_roll = die_roll
+            child = self.nodes.acquire(new_state, leaf)
+            leaf.children.append(child)
+            return child
+
         # If fully expanded, the leaf should not be chosen, should be its children instead
         assert not leaf.fully_expanded()
 
-        state = leaf.state
-        player = state.get_turn_player()  # Player of current turn
         die_roll = state.die_roll
-        movable_plane_inx = player.get_movable_planes(die_roll)
+        movable_plane_inx = state.get_distinct_moves(die_roll)
         actions_taken = set([child.action for child in leaf.children])
 
         diff = list(set(movable_plane_inx) - actions_taken)
@@ -243,30 +869,52 @@ class MCTSAgent(AeroplaneChessAgent):
         assert not len(
             movable_plane_inx) > 0 or a is not None  # if has movable planes, then must be an available action
         new_state = state.generate_successor(a, die_roll)
-        roll_die(new_state)
-        child = MCTSNode(new_state, leaf, action=a)
+        child = self.nodes.acquire(new_state, leaf, action=a)
         leaf.children.append(child)
         return child
 
     def simulate(self, node: MCTSNode) -> float:
+        """
+        Roll out from the node state on a copy of its planes, moved in place until rollout_plies or the game ends
+        """
         state = node.state
-        for _ in range(10):
-            if state.is_win(self.color) or state.is_lose(self.color):
-                break
-
-            player = state.get_turn_player()  # Player of current turn
-            if state.die_roll is None:
-                die_roll = roll_die(node.state)
-            else:
-                die_roll = state.die_roll
-            movable_plane_inx = player.get_movable_planes(die_roll)
+        planes = list(state.planes)
+        occupancy = state.occupancy
+        colors = state.colors
+        # Finished planes of each player, only the plane moved can finish and finished planes are never caught
+        finished = [components & 0xF for components in state.components]
+        turn = state.turn
+        die_roll = state.die_roll
+        greedy = self.rollout_policy == 'greedy'
+        category = PLANE_CATEGORY
+        plies = 0
+        while (self.rollout_plies is None or plies < self.rollout_plies) and NUM_PLANES not in finished:
+            if die_roll is None:
+                die_roll = random.randint(1, 6)
+            start = turn * NUM_PLANES
+            # GameState.get_movable_planes unrolled for NUM_PLANES = 4
+            movable_plane_inx = MOVABLE[category[planes[start]] | category[planes[start + 1]] << 2 |
+                                        category[planes[start + 2]] << 4 | category[planes[start + 3]] << 6][die_roll]
 
+            action = None
             if len(movable_plane_inx) > 0:
-                new_state = state.generate_successor(random.choice(movable_plane_inx), die_roll)
-            else:
-                new_state = state.generate_successor(None, die_roll)
-            state = new_state
-        return self.evaluate_state(state)
+                if greedy:
+                    moves = MOVE_TABLE[colors[turn]]
+                    scores = PLANE_SCORES[colors[turn]]
+                    best = None
+                    for i in movable_plane_inx:
+                        code = planes[start + i]
+                        gain = scores[moves[code][die_roll][0]] - scores[code]
+                        if best is None or gain > best:
+                            best, action = gain, i
+                else:
+                    action = random.choice(movable_plane_inx)
+                if MOVE_TABLE[colors[turn]][planes[start + action]][die_roll][0] == FINISH:
+                    finished[turn] += 1
+            turn, occupancy = play_move(planes, occupancy, colors, turn, action, die_roll)
+            die_roll = None
+            plies += 1
+        return self.evaluate_planes(planes, colors)
 
     @staticmethod
     def backpropagate(result, child):
@@ -285,16 +933,269 @@ class MCTSAgent(AeroplaneChessAgent):
         return f"MCTS agent ({self.color})"
 
 
-Q = {}
+def _search_task(task):
+    agent, state, iterations, seed, deadline = task
+    random.seed(seed)
+    return agent._search(state, iterations=iterations, deadline=deadline)
+
+
+def _rollout_task(task):
+    agent, state, seed = task
+    random.seed(seed)
+    return agent.simulate(MCTSNode(state, parent=None))
+
+
+NAN = float('nan')
+NAN_ENTRY = array('d', [NAN] * NUM_PLANES)
+
+
+class WideKeys:
+    """
+    Keys of a saved Q table wider than 64 bits, read as ints from their little-endian words for binary search
+    """
+
+    def __init__(self, words: memoryview, width: int):
+        self.words = words
+        self.width = width
+
+    def __len__(self):
+        return len(self.words) // self.width
+
+    def __getitem__(self, i: int) -> int:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        base = i * self.width
+        return sum(self.words[base + w] << (64 * w) for w in range(self.width))
+
+    def release(self):
+        self.words.release()
+
+
+class QTable:
+    """
+    Q values keyed by packed state (see pack_state), NUM_PLANES action values per entry in a flat array,
+    NaN marks actions that are not movable. When the table is full an entry is evicted with the clock
+    (second chance) policy. Saved as a binary file of sorted fixed-width keys followed by the values. A loaded
+    file stays memory mapped and is binary searched on lookup, its entries are copied into the table when written.
+    """
+    MAGIC = b'AQT2'
+    HEADER = struct.Struct('<4sII4x')  # magic, entries, 64 bit words per key, padding to align the keys
+
+    def __init__(self, max_entries: int = Q_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.slots = {}  # packed state -> slot
+        self.keys = []  # slot -> packed state
+        self.values = array('d')
+        self.referenced = bytearray()
+        self.hand = 0
+        self.changed = None  # Keys updated since tracking started, None when not tracking
+        # Loaded file, not counted in max_entries: sorted keys and their values, read through the mapping
+        self.data = None
+        self.loaded_keys = ()
+        self.loaded_values = None
+        self.shadowed = 0  # Entries of the table that are also loaded
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.slots or self._loaded_index(key) is not None
+
+    def __len__(self):
+        return len(self.slots) + len(self.loaded_keys) - self.shadowed
+
+    def _loaded_index(self, key: int) -> [NoneType, int]:
+        keys = self.loaded_keys
+        i = bisect.bisect_left(keys, key)
+        return i if i < len(keys) and keys[i] == key else None
+
+    def _find(self, key: int) -> [NoneType, tuple[array, int]]:
+        """
+        Values and offset of the entry of key, in the table or else in the loaded file, None if missing
+        """
+        slot = self.slots.get(key)
+        if slot is not None:
+            self.referenced[slot] = 1
+            return self.values, slot * NUM_PLANES
+        i = self._loaded_index(key)
+        return None if i is None else (self.loaded_values, i * NUM_PLANES)
+
+    def _entry(self, key: int) -> tuple[array, int]:
+        entry = self._find(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def _slot(self, key: int) -> int:
+        """
+        Slot of the entry of key, copied from the loaded file if it is only there
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            i = self._loaded_index(key)
+            if i is None:
+                raise KeyError(key)
+            slot = self._allocate(key)
+            self.values[slot * NUM_PLANES:(slot + 1) * NUM_PLANES] = array(
+                'd', self.loaded_values[i * NUM_PLANES:(i + 1) * NUM_PLANES])
+        self.referenced[slot] = 1
+        return slot
+
+    def reset(self, key: int, actions: list[int]):
+        """
+        Set the values of actions to 0 and clear the others, adding the entry if missing
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        self.referenced[slot] = 1
+        base = slot * NUM_PLANES
+        for a in range(NUM_PLANES):
+            self.values[base + a] = NAN
+        for a in actions:
+            self.values[base + a] = 0.0
+        if self.changed is not None:
+            self.changed.add(key)
+
+    def _allocate(self, key: int) -> int:
+        if len(self.keys) < self.max_entries:
+            slot = len(self.keys)
+            self.keys.append(key)
+            self.values.extend(NAN_ENTRY)
+            self.referenced.append(0)
+        else:
+            # Advance the clock hand past recently used entries, clearing their bit
+            while self.referenced[self.hand]:
+                self.referenced[self.hand] = 0
+                self.hand = (self.hand + 1) % self.max_entries
+            slot = self.hand
+            self.hand = (self.hand + 1) % self.max_entries
+            evicted = self.keys[slot]
+            del self.slots[evicted]
+            if self._loaded_index(evicted) is not None:  # Falls back to the loaded values
+                self.shadowed -= 1
+            self.keys[slot] = key
+        self.slots[key] = slot
+        if self._loaded_index(key) is not None:
+            self.shadowed += 1
+        return slot
+
+    def best_action(self, key: int) -> int:
+        values, base = self._entry(key)
+        best = None
+        for a in range(NUM_PLANES):
+            v = values[base + a]
+            if v == v and (best is None or v > values[base + best]):
+                best = a
+        return best
+
+    def value(self, key: int, action: int) -> float:
+        values, base = self._entry(key)
+        return values[base + action]
+
+    def add(self, key: int, action: int, delta: float):
+        self.values[self._slot(key) * NUM_PLANES + action] += delta
+        if self.changed is not None:
+            self.changed.add(key)
+
+    def changes(self, base: Self) -> list[tuple[int, tuple[float, ...]]]:
+        """
+        Value deltas of the changed entries relative to base, entries missing from base are taken in full
+        """
+        changes = []
+        for key in self.changed:
+            slot = self.slots.get(key)
+            if slot is None:  # Evicted after the change
+                continue
+            values = self.values[slot * NUM_PLANES:(slot + 1) * NUM_PLANES]
+            entry = base._find(key)
+            if entry is not None:
+                base_values, offset = entry
+                values = [v - base_values[offset + a] for a, v in enumerate(values)]
+            changes.append((key, tuple(values)))
+        return changes
+
+    def merge(self, changes: list[tuple[int, tuple[float, ...]]]):
+        """
+        Add value deltas from QTable.changes, adding the entries that are missing
+        """
+        for key, deltas in changes:
+            if key not in self:
+                self.reset(key, [a for a, d in enumerate(deltas) if d == d])
+            base = self._slot(key) * NUM_PLANES
+            for a, d in enumerate(deltas):
+                if d == d:
+                    self.values[base + a] += d
+
+    def clear(self):
+        self.slots.clear()
+        self.keys.clear()
+        del self.values[:]
+        self.referenced.clear()
+        self.hand = 0
+        if self.changed is not None:
+            self.changed = set()
+        if self.data is not None:
+            self.loaded_keys.release()
+            self.loaded_values.release()
+            self.data.close()
+        self.data = None
+        self.loaded_keys = ()
+        self.loaded_values = None
+        self.shadowed = 0
+
+    def save(self, path: str):
+        """
+        Write the entries of the table and the loaded file to path, replaced at once so a mapping of it stays valid
+        """
+        loaded = {key: i for i, key in enumerate(self.loaded_keys)}
+        keys = sorted(loaded.keys() | self.slots.keys())
+        words = max(1, ceil(max(keys, default=0).bit_length() / 64))
+        key_words = array('Q')
+        values = array('d')
+        for key in keys:
+            for w in range(words):
+                key_words.append(key >> (64 * w) & 0xFFFFFFFFFFFFFFFF)
+            slot = self.slots.get(key)
+            if slot is not None:
+                values.extend(self.values[slot * NUM_PLANES:(slot + 1) * NUM_PLANES])
+            else:
+                values.extend(self.loaded_values[loaded[key] * NUM_PLANES:(loaded[key] + 1) * NUM_PLANES])
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, len(keys), words))
+            key_words.tofile(f)
+            values.tofile(f)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path: str):
+        """
+        Replace the entries with the ones saved at path
+        """
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, words = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC:
+            data.close()
+            raise ValueError(f"{path} is not a Q table file of this version")
+        self.clear()
+        self.data = data
+        view = memoryview(data)
+        start = self.HEADER.size
+        end = start + n * words * 8
+        keys = view[start:end].cast('Q')
+        self.loaded_keys = keys if words == 1 else WideKeys(keys, words)
+        self.loaded_values = view[end:end + n * NUM_PLANES * 8].cast('d')
+
+
+Q = QTable()
 
 
 class RLAgent(AeroplaneChessAgent):
+    learning = True  # Whether moves update the shared Q table, off to play games from a fixed trained table
+
     def __init__(self, color: str):
         super().__init__(color)
         self.alpha = 1.0
         self.gamma = 0.9
         self.epsilon = 0.2
-        self.prev_state = None
+        self.prev_key = None
         self.prev_action = None
 
     def get_action(self, state: GameState, die_v: int):
@@ -302,20 +1203,26 @@ class RLAgent(AeroplaneChessAgent):
 
         action = None
         if len(movable_planes_inx) > 0:
-            reward = self.evaluate_state(state)
+            reward = self.evaluate(state)
+            key = pack_state(state.planes, state.turn, die_v)
+            if self.stats is not None:
+                self.stats.cache_lookups += 1
+                self.stats.cache_hits += key in Q
 
-            if random.uniform(0, 1) < self.epsilon or state not in Q:
+            if random.uniform(0, 1) < self.epsilon or key not in Q:
                 action = random.choice(movable_planes_inx)
-                Q[state] = {a: 0 for a in movable_planes_inx}
+                if self.learning:
+                    Q.reset(key, movable_planes_inx)
             else:
-                action = max(Q[state], key=lambda act: Q[state][act])
-
-            best_q = Q[state][action]
-            if self.prev_state is not None:
-                Q[self.prev_state][self.prev_action] += self.alpha * (reward + self.gamma * best_q - Q[state][action])
+                action = Q.best_action(key)
 
-            self.prev_state = state
-            self.prev_action = action
+            if self.learning:
+                best_q = Q.value(key, action)
+                # The previous entry may have been evicted since the last move
+                if self.prev_key is not None and self.prev_key in Q:
+                    Q.add(self.prev_key, self.prev_action, self.alpha * (reward + self.gamma * best_q - best_q))
+                self.prev_key = key
+                self.prev_action = action
 
         return action
 
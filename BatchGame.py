@@ -0,0 +1,166 @@
+import collections
+import time
+
+import numpy as np
+
+from Agent import PLANE_SCORES
+from GameBoard import MOVE_TABLE, MAIN_SQUARE, NUM_CODES, NUM_PLANES, HANGAR, FINAL_BASE, FINISH
+from utils import OPPONENT
+
+
+def build_tables(colors: tuple[str, ...]):
+    """
+    MOVE_TABLE as arrays indexed by [player, code, die]: final code (-1 if illegal move), squares to catch on
+    (-1 if none) and final stretch catch flag. Also the main track square of each [player, code] (-1 if not on it).
+    """
+    num_players = len(colors)
+    next_code = np.full((num_players, NUM_CODES, 7), -1, dtype=np.int16)
+    land = np.full((num_players, NUM_CODES, 7), -1, dtype=np.int16)
+    post = np.full((num_players, NUM_CODES, 7), -1, dtype=np.int16)
+    catch_final = np.zeros((num_players, NUM_CODES, 7), dtype=bool)
+    main_square = np.full((num_players, NUM_CODES), -1, dtype=np.int16)
+    for p, color in enumerate(colors):
+        for code in range(NUM_CODES):
+            if MAIN_SQUARE[color][code] is not None:
+                main_square[p, code] = MAIN_SQUARE[color][code]
+            for die_v in range(1, 7):
+                move = MOVE_TABLE[color][code][die_v]
+                if move is None:
+                    continue
+                code2, _, catch_squares, final = move
+                next_code[p, code, die_v] = code2
+                if len(catch_squares) > 0:
+                    land[p, code, die_v] = catch_squares[0]
+                if len(catch_squares) > 1:
+                    post[p, code, die_v] = catch_squares[1]
+                catch_final[p, code, die_v] = final
+    return next_code, land, post, catch_final, main_square
+
+
+def random_policy(game, games, dice, movable):
+    """
+    Pick a movable plane uniformly at random
+    """
+    keys = game.rng.random(movable.shape)
+    keys[~movable] = -1
+    return np.where(movable.any(axis=1), keys.argmax(axis=1), -1)
+
+
+def greedy_policy(game, games, dice, movable):
+    """
+    Move the plane with the highest evaluate_state plane score gain (launching and finishing first)
+    """
+    turn = game.turn[games]
+    codes = game.codes[games, turn]
+    next_code = game.next_code[turn[:, None], codes, dice[:, None]]
+    gains = game.plane_scores[turn[:, None], np.maximum(next_code, 0)] - game.plane_scores[turn[:, None], codes]
+    gains[~movable] = -np.inf
+    return np.where(movable.any(axis=1), gains.argmax(axis=1), -1)
+
+
+class BatchGame:
+    """
+    Play num_games games in lockstep, every step rolls a die and moves a plane in all unfinished games.
+    Planes use the GameBoard packed codes, codes[game, player, plane].
+    """
+
+    def __init__(self, num_games: int, colors: tuple[str, ...] = ('B', 'G'), policies=None, seed: int = None):
+        self.num_games = num_games
+        self.colors = colors
+        self.num_players = len(colors)
+        self.policies = policies if policies is not None else [random_policy] * self.num_players
+        self.rng = np.random.default_rng(seed)
+        self.next_code, self.land, self.post, self.catch_final, self.main_square = build_tables(colors)
+        self.plane_scores = np.array([PLANE_SCORES[color] for color in colors])
+        # Player index whose final stretch the big jump crosses, -1 if not playing
+        self.opponent = np.array([colors.index(OPPONENT[color]) if OPPONENT[color] in colors else -1
+                                  for color in colors], dtype=np.int8)
+
+        self.codes = np.full((num_games, self.num_players, NUM_PLANES), HANGAR, dtype=np.int16)
+        self.turn = np.zeros(num_games, dtype=np.int8)
+        self.plies = np.zeros(num_games, dtype=np.int32)
+        self.winner = np.full(num_games, -1, dtype=np.int8)
+
+    @property
+    def is_over(self):
+        return bool((self.winner >= 0).all())
+
+    def movable_planes(self, games, dice):
+        turn = self.turn[games]
+        return self.next_code[turn[:, None], self.codes[games, turn], dice[:, None]] >= 0
+
+    def step(self, dice=None, actions=None):
+        """
+        Roll dice (or use the given ones) for every unfinished game, pick actions with the players' policies
+        (or use the given ones, -1 to pass) and apply them
+        """
+        games = np.flatnonzero(self.winner < 0)
+        if dice is None:
+            dice = self.rng.integers(1, 7, size=len(games))
+        else:
+            dice = np.asarray(dice)[games]
+        movable = self.movable_planes(games, dice)
+        if actions is None:
+            actions = np.full(len(games), -1, dtype=np.int64)
+            turn = self.turn[games]
+            for p in range(self.num_players):
+                mask = turn == p
+                if mask.any():
+                    actions[mask] = self.policies[p](self, games[mask], dice[mask], movable[mask])
+        else:
+            actions = np.asarray(actions)[games]
+        self.apply(games, dice, actions)
+
+    def apply(self, games, dice, actions):
+        turn = self.turn[games]
+        moving = actions >= 0
+        g, t, a, d = games[moving], turn[moving], actions[moving], dice[moving]
+
+        old = self.codes[g, t, a]
+        self.codes[g, t, a] = self.next_code[t, old, d]
+        land, post = self.land[t, old, d], self.post[t, old, d]
+
+        # Catch other players' planes on the landing and after jump squares
+        for p in range(self.num_players):
+            squares = self.main_square[p, self.codes[g, p]]
+            caught = (t != p)[:, None] & (squares >= 0) & ((squares == land[:, None]) | (squares == post[:, None]))
+            if caught.any():
+                codes = self.codes[g, p]
+                codes[caught] = HANGAR
+                self.codes[g, p] = codes
+
+        # Big jump catches the crossed opponent planes on final stretch square 3
+        opponent = self.opponent[t]
+        final = self.catch_final[t, old, d] & (opponent >= 0)
+        if final.any():
+            g2, p2 = g[final], opponent[final]
+            codes = self.codes[g2, p2]
+            codes[codes == FINAL_BASE + 3] = HANGAR
+            self.codes[g2, p2] = codes
+
+        won = moving.copy()
+        won[moving] = (self.codes[g, t] == FINISH).all(axis=1)
+        self.winner[games[won]] = turn[won]
+        self.plies[games] += 1
+        self.turn[games] = np.where(dice == 6, turn, (turn + 1) % self.num_players)
+
+    def run(self, max_plies: int = 10000):
+        for _ in range(max_plies):
+            if self.is_over:
+                break
+            self.step()
+        return self.winner
+
+
+def start_batch(num_games: int = 10000):
+    start = time.time()
+    game = BatchGame(num_games)
+    winner = game.run()
+    duration = time.time() - start
+    counter = collections.Counter(game.colors[w] for w in winner if w >= 0)
+    print("Winner summary:", counter)
+    print(f"{num_games} games in {duration:.2f}s, {num_games / duration:.0f} games/s")
+
+
+if __name__ == '__main__':
+    start_batch()
@@ -0,0 +1,199 @@
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+from Game import Game, Player, AGENTS
+from GameBoard import GameState
+
+CORPUS_PATH = 'benchmark_positions.json'
+COLORS = ['B', 'G']
+
+
+def make_corpus(num_positions: int, seed: int = 0) -> list[dict]:
+    """
+    Mid-game positions of random games, each with a die roll that leaves the player to move a choice
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < num_positions:
+        random.seed(rng.getrandbits(32))
+        game = Game(num_players=2, agents=['Random', 'Random'])
+        ply = rng.randint(20, 120)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(ply):
+                if game.is_over:
+                    break
+                game.player_move()
+        state = game.state
+        die_v = rng.randint(1, 6)
+        if not game.is_over and len(state.get_distinct_moves(die_v)) > 1:
+            positions.append({'planes': list(state.planes), 'turn': state.turn, 'die': die_v})
+    return positions
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list[tuple[GameState, int]]:
+    with open(path) as f:
+        positions = json.load(f)
+    players = [Player(color) for color in COLORS]
+    return [(GameState(players, p['turn'], tuple(p['planes'])), p['die']) for p in positions]
+
+
+def fresh_states(corpus, repeat: int) -> list[GameState]:
+    """
+    New states of the corpus positions, so cached moves and views are not reused between calls
+    """
+    return [GameState(state._players, state.turn, state.planes) for _ in range(repeat) for state, _ in corpus]
+
+
+def best_time(func, rounds: int, setup=None) -> float:
+    """
+    Shortest of rounds timed runs, the least disturbed by other processes. When given, the untimed setup() result
+    is passed to func.
+    """
+    durations = []
+    for _ in range(rounds):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def throughput(name: str, func, calls: int, rounds: int, setup=None, unit: str = 'calls/s') -> dict:
+    return {name: {'value': calls / best_time(func, rounds, setup), 'unit': unit, 'higher_is_better': True}}
+
+
+def bench_engine(corpus, repeat: int, rounds: int) -> dict:
+    results = {}
+    moves = [(state, a, die_v) for state, _ in corpus for die_v in range(1, 7)
+             for a in state.get_movable_planes(die_v)] * repeat
+
+    def successors():
+        for state, a, die_v in moves:
+            state.generate_successor(a, die_v)
+    results.update(throughput('generate_successor', successors, len(moves), rounds))
+
+    def setup():
+        return fresh_states(corpus, repeat)
+
+    def movable(states):
+        for state in states:
+            state.get_movable_planes(6)
+    results.update(throughput('get_movable_planes', movable, len(corpus) * repeat, rounds, setup))
+
+    agent = AGENTS['Random'](COLORS[0])
+
+    def evaluate_state(states):
+        for state in states:
+            agent.evaluate_state(state)
+    results.update(throughput('evaluate_state', evaluate_state, len(corpus) * repeat, rounds, setup))
+
+    def evaluate(states):
+        for state in states:
+            agent.evaluate(state)
+    results.update(throughput('evaluate', evaluate, len(corpus) * repeat, rounds, setup))
+    return results
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def bench_agents(corpus, agents: list[str], seed: int, rounds: int) -> dict:
+    """
+    get_action latency of each agent class on every corpus position, with a new agent and a fixed seed per position
+    """
+    results = {}
+    for name in agents:
+        latencies = []
+        for i, (state, die_v) in enumerate(corpus):
+            def setup():
+                random.seed(seed + i)
+                return AGENTS[name](COLORS[state.turn]), GameState(state._players, state.turn, state.planes)
+
+            def get_action(args):
+                agent, new_state = args
+                agent.get_action(new_state, die_v)
+            latencies.append(best_time(get_action, rounds, setup))
+        for stat, value in [('mean', sum(latencies) / len(latencies)), ('p50', percentile(latencies, 0.5)),
+                            ('p90', percentile(latencies, 0.9)), ('max', max(latencies))]:
+            results[f'{name}.get_action.{stat}'] = {'value': value, 'unit': 's', 'higher_is_better': False}
+    return results
+
+
+def bench_games(num_games: int, seed: int, rounds: int) -> dict:
+    def games():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(num_games):
+                random.seed(seed + i)
+                game = Game(num_players=2, agents=['Random', 'Random'])
+                while not game.is_over:
+                    game.player_move()
+    return throughput('random_games', games, num_games, rounds, unit='games/s')
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Names of the results worse than the baseline by more than tolerance (a fraction of the baseline value)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]['value']
+        value = result['value']
+        if result['higher_is_better'] and value < base * (1 - tolerance) or \
+                not result['higher_is_better'] and value > base * (1 + tolerance):
+            regressions.append(f"{name}: {value:.6g} {result['unit']}, baseline {base:.6g}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the engine and agents, optionally against a saved baseline")
+    parser.add_argument('--corpus', default=CORPUS_PATH, help="Mid-game positions file")
+    parser.add_argument('--make-corpus', type=int, default=None, metavar='N', help="Write a new corpus of N positions")
+    parser.add_argument('--agents', nargs='*', default=list(AGENTS), choices=AGENTS)
+    parser.add_argument('--repeat', type=int, default=100, help="Passes over the corpus for engine benchmarks")
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=5, help="Timed runs of each benchmark, the fastest is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Write the results as JSON to this path")
+    parser.add_argument('--baseline', default=None, help="Results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed slowdown as a fraction of the baseline")
+    args = parser.parse_args()
+
+    if args.make_corpus is not None:
+        with open(args.corpus, 'w') as f:
+            # One position per line
+            f.write('[\n' + ',\n'.join(json.dumps(p) for p in make_corpus(args.make_corpus, args.seed)) + '\n]\n')
+        return
+
+    corpus = load_corpus(args.corpus)
+    results = {}
+    results.update(bench_engine(corpus, args.repeat, args.rounds))
+    results.update(bench_agents(corpus, args.agents, args.seed, args.rounds))
+    results.update(bench_games(args.games, args.seed, args.rounds))
+    for name, result in results.items():
+        print(f"{name}: {result['value']:.6g} {result['unit']}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'results': results}, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
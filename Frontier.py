@@ -0,0 +1,138 @@
+import numpy as np
+
+from BatchGame import build_tables
+from GameBoard import GameState, PLANE_COMPONENTS, NUM_CODES, NUM_PLANES, HANGAR, FINAL_BASE, FINISH, CODE_BITS, \
+    unpack_components
+from utils import OPPONENT
+
+# AeroplaneChessAgent.evaluate as a linear model: weights of (finished, on hangar, steps, final stretch distance)
+# in units of one step, and the value of a unit
+EVALUATE_WEIGHTS = (2000, -1000, 1, 1)
+EVALUATE_SCALE = 0.05
+
+
+class LinearEvaluator:
+    """
+    Vector evaluator of packed states codes[state, player, plane]: a weighted sum of the score components of every
+    plane (see PLANE_COMPONENTS), with one weight vector for all players or one per player. With integer weights the
+    sum is exact, so the default weights give the same values as AeroplaneChessAgent.evaluate.
+    """
+
+    def __init__(self, num_players: int, weights=EVALUATE_WEIGHTS, scale: float = EVALUATE_SCALE):
+        features = np.array([unpack_components(PLANE_COMPONENTS[code]) for code in range(NUM_CODES)], dtype=np.float64)
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), (num_players, features.shape[1]))
+        self.table = weights @ features.T  # [player, code] -> plane value
+        self.scale = scale
+
+    def __call__(self, codes: np.ndarray) -> np.ndarray:
+        players = np.arange(codes.shape[1])[None, :, None]
+        return self.table[players, codes].sum(axis=(1, 2)) * self.scale
+
+
+class FrontierSearch:
+    """
+    Expectimax values of whole subtrees computed level by level on arrays of packed states: every level expands all
+    states with every die and plane, states reached more than once (in any plane order) are searched once, the leaves
+    are scored in one evaluator call and the values are backed up with array reductions. Same tree and values as
+    ExpectimaxAgent without pruning, under the default rules (not STACK_BLOCKS), with the opponents' moves averaged
+    or, if paranoid, minimised with the default leaves scored against the agent (evaluate_against).
+    """
+
+    def __init__(self, colors: tuple[str, ...], color: str, evaluator=None, paranoid: bool = False):
+        self.num_players = len(colors)
+        self.me = colors.index(color)
+        self.paranoid = paranoid
+        if evaluator is None:
+            weights = np.array(EVALUATE_WEIGHTS)
+            if paranoid:
+                # The agent's planes count for it and the other players' against it (evaluate_against)
+                weights = np.where(np.arange(self.num_players)[:, None] == self.me, weights, -weights)
+            evaluator = LinearEvaluator(self.num_players, weights)
+        self.evaluator = evaluator
+        self.next_code, self.land, self.post, self.catch_final, self.main_square = build_tables(colors)
+        # Player index whose final stretch the big jump crosses, -1 if not playing
+        self.opponent = np.array([colors.index(OPPONENT[c]) if OPPONENT[c] in colors else -1 for c in colors],
+                                 dtype=np.int64)
+        # Whether a turn and all plane codes fit in one int64 key
+        self.packable = 2 + CODE_BITS * self.num_players * NUM_PLANES < 64
+        self.leaves = 0  # States evaluated, for search statistics
+
+    def value(self, state: GameState, moves: int) -> float:
+        """
+        Value of state before the player to move rolls the die, searching at most `moves` more moves
+        (ExpectimaxAgent._roll)
+        """
+        codes = np.array(state.planes, dtype=np.int64).reshape(1, self.num_players, NUM_PLANES)
+        return float(self.values(codes, np.array([state.turn]), moves)[0])
+
+    def values(self, codes: np.ndarray, turn: np.ndarray, moves: int) -> np.ndarray:
+        values = self.evaluator(codes)
+        self.leaves += len(codes)
+        if moves == 0:
+            return values
+        # Finished games are leaves whatever the die
+        live = np.flatnonzero(~(codes == FINISH).all(axis=2).any(axis=1))
+        if len(live) == 0:
+            return values
+        codes, turn = codes[live], turn[live]
+        n = len(live)
+
+        # Every (state, die, plane) move, dice 1 to 6 at index 0 to 5
+        own = codes[np.arange(n), turn]
+        dice = np.arange(1, 7)
+        next_code = self.next_code[turn[:, None, None], own[:, None, :], dice[None, :, None]]
+        valid = next_code >= 0
+        s, d, a = np.nonzero(valid)
+        children = self.play(codes[s], turn[s], a, dice[d], own[s, a])
+        child_turn = np.where(d == 5, turn[s], (turn[s] + 1) % self.num_players)
+
+        # Search each distinct child once: planes of a player sorted, then packed into one int with the turn
+        children.sort(axis=2)
+        if self.packable:
+            keys = child_turn.copy()
+            for code in children.reshape(len(children), -1).T:
+                keys = keys << CODE_BITS | code
+        else:
+            keys = np.column_stack([child_turn, children.reshape(len(children), -1)])
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True, axis=None if self.packable else 0)
+        inverse = inverse.reshape(-1)
+        child_values = self.values(children[first], child_turn[first], moves - 1)[inverse]
+
+        # Max over the agent's moves, mean over the opponents' uniformly random moves (min if paranoid), the state
+        # itself without moves
+        grid = np.zeros((n, 6, NUM_PLANES))
+        grid[s, d, a] = child_values
+        movable = valid.sum(axis=2)
+        best = np.where(valid, grid, -np.inf).max(axis=2)
+        if self.paranoid:
+            other = np.where(valid, grid, np.inf).min(axis=2)
+        else:
+            other = grid.sum(axis=2) / np.maximum(movable, 1)
+        node = np.where((turn == self.me)[:, None], best, other)
+        node = np.where(movable > 0, node, values[live][:, None])
+        values[live] = node.sum(axis=1) / 6
+        return values
+
+    def play(self, codes: np.ndarray, turn: np.ndarray, action: np.ndarray, dice: np.ndarray,
+             old: np.ndarray) -> np.ndarray:
+        """
+        Move plane action of the player to move with dice in each of codes, in place as BatchGame.apply
+        """
+        rows = np.arange(len(codes))
+        codes[rows, turn, action] = self.next_code[turn, old, dice]
+        land, post = self.land[turn, old, dice], self.post[turn, old, dice]
+
+        # Catch other players' planes on the landing and after jump squares
+        for p in range(self.num_players):
+            squares = self.main_square[p, codes[:, p]]
+            caught = (turn != p)[:, None] & (squares >= 0) & ((squares == land[:, None]) | (squares == post[:, None]))
+            codes[:, p][caught] = HANGAR
+
+        # Big jump catches the crossed opponent planes on final stretch square 3
+        opponent = self.opponent[turn]
+        final = np.flatnonzero(self.catch_final[turn, old, dice] & (opponent >= 0))
+        if len(final) > 0:
+            crossed = codes[final, opponent[final]]
+            crossed[crossed == FINAL_BASE + 3] = HANGAR
+            codes[final, opponent[final]] = crossed
+        return codes
@@ -3,9 +3,10 @@ import optparse
 import time
 from copy import deepcopy
 from sys import argv
+from types import NoneType
 from typing_extensions import Self
 
-from Agent import AeroplaneChessAgent, RandomAgent, ExpectimaxAgent, MCTSAgent, RLAgent
+from Agent import AeroplaneChessAgent, RandomAgent, ExpectimaxAgent, MCTSAgent, RLAgent, Q
 import random, os
 from argparse import ArgumentParser
 
@@ -14,7 +15,8 @@ from colorama import Fore
 from colorama import Style
 
 from GameBoard import Plane, GameBoard, GameState
-from utils import NUM_SQUARES, OPPONENT, AGENT1, roll_die, CONFIG
+from Instrumentation import DecisionStats, clock
+from utils import NUM_SQUARES, PLAYER_COLORS, AGENT1, Q_TABLE_PATH, roll_die, CONFIG
 
 colorama_init()
 
@@ -32,9 +34,17 @@ class Player:
     def take_action(self, state: GameState) -> (Plane, int):
         die_v = roll_die(state)
 
-        start = time.time()
-        a = self.agent.get_action(state, die_v)
-        self.decision_time_record.append(time.time() - start)
+        agent = self.agent
+        if agent.hook is not None:
+            agent.stats = DecisionStats(str(agent))
+        start = clock()
+        a = agent.get_action(state, die_v)
+        elapsed = clock() - start
+        self.decision_time_record.append(elapsed)
+        if agent.stats is not None:
+            agent.stats.time = elapsed
+            agent.hook.record(agent.stats)
+            agent.stats = None
         return a, die_v
 
     def get_movable_planes(self, die_v: int) -> list[int]:
@@ -83,35 +93,51 @@ class Player:
         return copy_self
 
 
+AGENTS = {
+    'Random': RandomAgent,
+    'Expectimax': ExpectimaxAgent,
+    'MCTS': MCTSAgent,
+    'RL': RLAgent,
+}
+
+
 class Game:
-    def __init__(self, num_players: int):
-        assert num_players == 2
-        # Blue player has Green as opponent, green player is the only player that can catch blue in final stretch
-        # Now consider only two players
-
-        if AGENT1 == 'Expectimax':
-            players = [Player('B', agent=ExpectimaxAgent('B')), Player('G')]
-        elif AGENT1 == 'MCTS':
-            players = [Player('B', agent=MCTSAgent('B')), Player('G')]
-        elif AGENT1 == 'RL':
-            players = [Player('B', agent=RLAgent('B')), Player('G')]
-        else:
-            players = [Player('B'), Player('G')]
+    def __init__(self, num_players: int, agents: list[str] = None, agent_params: dict[str, dict] = None):
+        """
+        agents: agent name of each player, agent_params: constructor keyword arguments of agents by name
+        """
+        assert num_players in PLAYER_COLORS
+        # Two players are Blue and Green, whose big jumps cross each other's final stretch
+        if agents is None:
+            agents = [AGENT1 if AGENT1 is not None else 'Random'] + ['Random'] * (num_players - 1)
+        assert len(agents) == num_players
+        agent_params = agent_params or {}
+        players = [Player(color, agent=AGENTS[name](color, **agent_params.get(name, {})))
+                   for color, name in zip(PLAYER_COLORS[num_players], agents)]
 
         turn = 0  # Player 1
         self.is_over = False
         self.state = GameState(players, turn)
         self.winner = None
         self.decision_time_sum = {}
+        self.recorder = None  # GameRecorder of this game's plies, if recorded
 
     def player_move(self):
         cur_player = self.state.players[self.state.turn]
         action, die_v = cur_player.take_action(self.state)
+        self.apply_move(action, die_v)
 
+    def apply_move(self, action: [NoneType, int], die_v: int):
+        """
+        Play action of the player to move with die_v, and check if the game is over
+        """
+        cur_player = self.state.players[self.state.turn]
         event_log = ""
         event_log += f"{cur_player.color} player rolled Die: {die_v}\n"
 
         self.state = self.state.generate_successor(action, die_v, show_event=CONFIG['display'])
+        if self.recorder is not None:
+            self.recorder.record_ply(die_v, action, self.state)
 
         if action is not None:
             event_log += f"{Fore.RED}Player {cur_player} moved plane {action}{Style.RESET_ALL}\n"
@@ -120,10 +146,10 @@ class Game:
             print(f"{Fore.RED}Player {cur_player} wins the game!{Style.RESET_ALL}")
             self.is_over = True
             self.winner = cur_player.color
-        elif self.state.is_lose(cur_player.color):  # Consider only two players
-            print(f"{Fore.RED}Player {OPPONENT[cur_player.color]} wins the game!{Style.RESET_ALL}")
+        elif self.state.is_lose(cur_player.color):
+            self.winner = next(color for color in self.state.colors if self.state.is_win(color))
+            print(f"{Fore.RED}Player {self.winner} wins the game!{Style.RESET_ALL}")
             self.is_over = True
-            self.winner = OPPONENT[cur_player.color]
         else:
             event_log += f"{cur_player.get_remaining_planes_count()} planes left.\n"
 
@@ -144,11 +170,16 @@ def start_game():
         decision_time_history = {}  # Store total decision time for all games
 
         if AGENT1 == 'RL':
-            for i in range(1000):
-                print(f"Playing {i+1}th game (Training)...")
-                game = Game(num_players=2)
-                while not game.is_over:
-                    game.player_move()
+            if os.path.exists(Q_TABLE_PATH):
+                Q.load(Q_TABLE_PATH)
+                print(f"Loaded {len(Q)} Q table entries from {Q_TABLE_PATH}")
+            else:
+                for i in range(1000):
+                    print(f"Playing {i+1}th game (Training)...")
+                    game = Game(num_players=2)
+                    while not game.is_over:
+                        game.player_move()
+                Q.save(Q_TABLE_PATH)
 
         for i in range(100):
             print(f"Playing {i+1}th game...")
@@ -1,10 +1,272 @@
-from copy import deepcopy
+import random
+from copy import copy
 from types import NoneType
 from typing_extensions import Self
 
 from colorama import Fore, Style
 
-from utils import COLORS, ENTRY, NUM_SQUARES, FS, JUMP_POINT, OPPONENT
+from utils import COLORS, ENTRY, NUM_SQUARES, FS, JUMP_POINT, OPPONENT, STACK_BLOCKS
+
+
+# Board layout shared by all game states
+NUM_PLANES = 4  # Planes per player
+SQUARE_COLORS = tuple(COLORS[i % 4] for i in range(NUM_SQUARES))
+
+# Packed plane encoding, one small int per plane holds (pos_type, pos, total_steps):
+#   0             Hangar
+#   1             Launch area
+#   1 + t         Main track after t total steps (t = 1..50), the square depends on the plane color
+#   52 + p        Final stretch square p (p = 0..6, a plane bouncing back from square 6 can end on square 0)
+#   59            Finished
+HANGAR = 0
+LAUNCH = 1
+MAIN_BASE = 1
+FINAL_BASE = 52
+FINISH = 59
+NUM_CODES = 60
+
+POS_TYPES = tuple('Hangar' if c == HANGAR else 'Launch' if c == LAUNCH else 'Main' if c < FINAL_BASE else
+                  'Final' if c < FINISH else 'Finish' for c in range(NUM_CODES))
+TOTAL_STEPS = tuple(0 if c <= LAUNCH else c - MAIN_BASE if c < FINAL_BASE else 50 for c in range(NUM_CODES))
+# Plane.pos of every code for each color
+PLANE_POS = {color: tuple(None if c in (HANGAR, FINISH) else -1 if c == LAUNCH else
+                          (ENTRY[color] + c - MAIN_BASE - 1) % NUM_SQUARES if c < FINAL_BASE else
+                          c - FINAL_BASE for c in range(NUM_CODES)) for color in ENTRY}
+# Main track square of every code, None when the plane is not on the main track
+MAIN_SQUARE = {color: tuple(pos if MAIN_BASE < c < FINAL_BASE else None for c, pos in enumerate(PLANE_POS[color]))
+               for color in ENTRY}
+
+
+# Score components of a plane packed into one int, so the components of several planes add up field by field:
+# finished (bits 0-3), on hangar (4-7), steps (8-15, 50 on the final stretch), distance to finish on the final stretch (16-23)
+PLANE_COMPONENTS = tuple((c == FINISH) | (c == HANGAR) << 4 | TOTAL_STEPS[c] << 8 |
+                         (FINISH - 1 - c if FINAL_BASE <= c < FINISH else 0) << 16 for c in range(NUM_CODES))
+
+
+def unpack_components(components: int) -> tuple[int, int, int, int]:
+    """
+    Finished count, hangar count, step sum and final stretch distance of packed score components
+    """
+    return components & 0xF, components >> 4 & 0xF, components >> 8 & 0xFF, components >> 16 & 0xFF
+
+
+def encode_plane(pos_type: str, pos: [NoneType, int], total_steps: int) -> int:
+    if pos_type == 'Hangar':
+        return HANGAR
+    elif pos_type == 'Launch':
+        return LAUNCH
+    elif pos_type == 'Main':
+        return MAIN_BASE + total_steps
+    elif pos_type == 'Final':
+        return FINAL_BASE + pos
+    return FINISH
+
+
+def move_code(code: int, steps: int) -> int:
+    """
+    Same rules as Plane.move on a packed plane
+    """
+    if code == HANGAR and steps == 6:
+        return LAUNCH
+    elif code == LAUNCH:
+        return MAIN_BASE + steps
+    elif FINAL_BASE <= code < FINISH:
+        pos = code - FINAL_BASE + steps
+        if pos > 6:  # Bounce back
+            return FINAL_BASE + 12 - pos
+        elif pos == 6:
+            return FINISH
+        return FINAL_BASE + pos
+    elif MAIN_BASE < code < FINAL_BASE:
+        total_steps = code - MAIN_BASE + steps
+        if total_steps > 50:  # Enter final stretch
+            return FINAL_BASE + total_steps - 50
+        return MAIN_BASE + total_steps
+    raise ValueError(f"Try to move plane {POS_TYPES[code]} when die roll {steps}.")
+
+
+# Jump taken by a move
+NO_JUMP = 0
+JUMP = 1
+BIG_JUMP = 2
+
+
+def build_move_table(color: str):
+    """
+    Resolve every (code, die) move of a color plane once, MOVE_TABLE[color][code][die] is None for illegal moves or
+    (final code, jump, main track squares to catch on, whether opponent plane on final stretch pos 3 is caught)
+    """
+    table = []
+    for code in range(NUM_CODES):
+        moves = [None]
+        for die_v in range(1, 7):
+            if code == FINISH or (code == HANGAR and die_v != 6):
+                moves.append(None)
+                continue
+            code2 = move_code(code, die_v)
+            jump = NO_JUMP
+            catch_squares = []
+            catch_final = False
+            pos = MAIN_SQUARE[color][code2]
+            if pos is not None:
+                catch_squares.append(pos)
+                if SQUARE_COLORS[pos] == color:
+                    if pos == JUMP_POINT[color] or (pos + 4) % NUM_SQUARES == JUMP_POINT[color]:
+                        code2 = move_code(code2, 16)
+                        jump = BIG_JUMP
+                        catch_final = True
+                    else:
+                        code2 = move_code(code2, 4)
+                        jump = JUMP
+                    if MAIN_SQUARE[color][code2] is not None:
+                        catch_squares.append(MAIN_SQUARE[color][code2])
+            moves.append((code2, jump, tuple(catch_squares), catch_final))
+        table.append(moves)
+    return table
+
+
+MOVE_TABLE = {color: build_move_table(color) for color in ENTRY}
+
+# Plane categories for move generation: 0 in hangar (moves on a 6), 1 on launch, main track or final stretch, 2 finished
+PLANE_CATEGORY = tuple(0 if c == HANGAR else 2 if c == FINISH else 1 for c in range(NUM_CODES))
+# MOVABLE[category mask][die]: indices of the movable planes of a player, the mask holds 2 bits per plane
+MOVABLE = tuple(tuple(tuple(j for j in range(NUM_PLANES) if mask >> 2 * j & 3 == 1 or mask >> 2 * j & 3 == 0 and die_v == 6)
+                      for die_v in range(7)) for mask in range(4 ** NUM_PLANES))
+UNIT_WEIGHTS = tuple((1,) * n for n in range(NUM_PLANES + 1))
+# Chance outcomes of each (color, codes of its planes), see GameState.get_chance_outcomes
+CHANCE_OUTCOMES = {}
+MAX_CHANCE_OUTCOMES = 100000
+
+# Occupancy is one board of the main track indexed by square: SQUARE_FIELD bits per square holding the number of
+# planes there (bits 0-2) and the index in COLORS of their player (bits 3-4). Planes of two players never share a
+# square, a plane landing catches the others, so catches and stacks are found on one square whatever the number of
+# players. A plane adds SQUARE_BITS[color][code] to the count and sets OWNER_BITS[color][code], the owner of a
+# square is stale when its count is 0.
+SQUARE_FIELD = 5
+SQUARE_BITS = {color: tuple(0 if square is None else 1 << SQUARE_FIELD * square for square in MAIN_SQUARE[color])
+               for color in ENTRY}
+OWNER_MASK = {color: tuple(0 if square is None else 3 << SQUARE_FIELD * square + 3 for square in MAIN_SQUARE[color])
+              for color in ENTRY}
+OWNER_BITS = {color: tuple(0 if square is None else COLORS.index(color) << SQUARE_FIELD * square + 3
+                           for square in MAIN_SQUARE[color]) for color in ENTRY}
+
+
+def square_count(occupancy: int, pos: int) -> int:
+    return occupancy >> SQUARE_FIELD * pos & 7
+
+
+def square_owner(occupancy: int, pos: int) -> str:
+    """
+    Color of the planes on main track square pos, only meaningful when square_count is not 0
+    """
+    return COLORS[occupancy >> SQUARE_FIELD * pos + 3 & 3]
+
+
+def occupy(occupancy: int, color: str, code: int) -> int:
+    """
+    Occupancy with a plane of color added at code, any other player's planes on its square must have been caught
+    """
+    return (occupancy & ~OWNER_MASK[color][code] | OWNER_BITS[color][code]) + SQUARE_BITS[color][code]
+
+
+def catch_planes(planes: list[int], occupancy: int, colors: tuple[str, ...], color: str, pos: int) -> tuple:
+    """
+    Send the planes of the player other than color on main track square pos back to hangar. Return the occupancy
+    without them and (slot, code) of the caught planes.
+    """
+    if not square_count(occupancy, pos):
+        return occupancy, ()
+    other = square_owner(occupancy, pos)
+    if other == color:
+        return occupancy, ()
+    caught = []
+    main_square = MAIN_SQUARE[other]
+    i = colors.index(other)
+    for j in range(i * NUM_PLANES, (i + 1) * NUM_PLANES):
+        if main_square[planes[j]] == pos:
+            caught.append((j, planes[j]))
+            planes[j] = HANGAR
+    return occupancy & ~(7 << SQUARE_FIELD * pos), caught
+
+
+def is_stacked(occupancy: int, color: str, pos: int) -> bool:
+    """
+    Whether another player than color has 2 or more planes on main track square pos
+    """
+    return square_count(occupancy, pos) >= 2 and square_owner(occupancy, pos) != color
+
+
+def blocked_move(move: tuple, code: int, die_v: int, stacked) -> tuple:
+    """
+    MOVE_TABLE move under the STACK_BLOCKS rule variant: a plane reaching a square where another player has 2 or more
+    planes stacked can't catch them and is bounced back, to where it was or, for a stack on its jump destination,
+    to the square before the jump. stacked(pos) tells whether there is such a stack on main track square pos.
+    """
+    for k, pos in enumerate(move[2]):
+        if stacked(pos):
+            if k == 0:
+                return code, NO_JUMP, (), False
+            return move_code(code, die_v), NO_JUMP, move[2][:1], False
+    return move
+
+# Zobrist keys for every (plane slot, code), turn and die roll (index 0 when not rolled yet). The planes of a player
+# share their keys and the hash is their sum modulo 2^64, so states that only differ in the order of a player's
+# planes (e.g. which of two planes launched) hash the same.
+MAX_PLAYERS = len(COLORS)
+_zobrist_rng = random.Random(2024)
+_player_keys = tuple(tuple(_zobrist_rng.getrandbits(64) for _ in range(NUM_CODES)) for _ in range(MAX_PLAYERS))
+ZOBRIST_PLANES = tuple(_player_keys[slot // NUM_PLANES] for slot in range(MAX_PLAYERS * NUM_PLANES))
+ZOBRIST_TURN = tuple(_zobrist_rng.getrandbits(64) for _ in range(MAX_PLAYERS))
+ZOBRIST_DIE = tuple(_zobrist_rng.getrandbits(64) for _ in range(7))
+ZOBRIST_MASK = (1 << 64) - 1
+
+
+def zobrist_hash(planes: tuple[int, ...], turn: int) -> int:
+    h = ZOBRIST_TURN[turn]
+    for slot, code in enumerate(planes):
+        h += ZOBRIST_PLANES[slot][code]
+    return h & ZOBRIST_MASK
+
+
+CODE_BITS = (NUM_CODES - 1).bit_length()
+
+
+def pack_state(planes: tuple[int, ...], turn: int, die_v: int) -> int:
+    """
+    Pack plane codes, turn and die roll into one int: CODE_BITS per plane, 2 bits turn, 3 bits die
+    """
+    key = 0
+    for code in planes:
+        key = key << CODE_BITS | code
+    return (key << 2 | turn) << 3 | (die_v or 0)
+
+
+def play_move(planes: list[int], occupancy: int, colors: tuple[str, ...], turn: int, action: [NoneType, int],
+              die_v: int) -> tuple[int, int]:
+    """
+    Apply a move to planes in place, same rules as GameState.generate_successor without hashing or events.
+    Return the next turn and the occupancy of the planes after the move.
+    """
+    if action is not None:
+        color = colors[turn]
+        slot = turn * NUM_PLANES + action
+        move = MOVE_TABLE[color][planes[slot]][die_v]
+        if STACK_BLOCKS:
+            move = blocked_move(move, planes[slot], die_v, lambda pos: is_stacked(occupancy, color, pos))
+        code, _, catch_squares, catch_final = move
+        occupancy -= SQUARE_BITS[color][planes[slot]]
+        planes[slot] = code
+        for pos in catch_squares:
+            occupancy, _ = catch_planes(planes, occupancy, colors, color, pos)
+        occupancy = occupy(occupancy, color, code)
+        if catch_final and OPPONENT[color] in colors:
+            opponent = colors.index(OPPONENT[color])
+            for j in range(opponent * NUM_PLANES, (opponent + 1) * NUM_PLANES):
+                if planes[j] == FINAL_BASE + 3:
+                    planes[j] = HANGAR
+    if die_v != 6:
+        return (turn + 1) % len(colors), occupancy
+    return turn, occupancy
 
 
 class Square:
@@ -91,6 +353,18 @@ class Plane:
     def is_finished(self):
         return self.pos_type == 'Finish'
 
+    @property
+    def code(self) -> int:
+        return encode_plane(self.pos_type, self.pos, self.total_steps)
+
+    @classmethod
+    def from_code(cls, color: str, ind: int, code: int) -> Self:
+        plane = cls(color, ind)
+        plane.pos_type = POS_TYPES[code]
+        plane.pos = PLANE_POS[color][code]
+        plane.total_steps = TOTAL_STEPS[code]
+        return plane
+
     def __eq__(self, other: Self):
         return self.pos_type == other.pos_type and \
                self.pos == other.pos and \
@@ -113,6 +387,11 @@ class GameBoard:
                                 for color in COLORS]
 
         self.planes = planes
+        for plane in planes:
+            if plane.is_on_main_track():
+                self.squares[plane.pos].planes.append(plane)
+            elif plane.is_on_final_stretch():
+                self.final_stretches[COLORS.index(plane.color)][plane.pos].planes.append(plane)
 
     def __repr__(self):
         main_track_str = ' '.join([s.__repr__() for s in self.squares])
@@ -156,6 +435,14 @@ class GameBoard:
             entries_str_l[f] = 'F'
         entries_str = ' '.join(entries_str_l).replace('0', ' ')
 
+        # Final stretches of the colors in play
+        in_play = {plane.color for plane in self.planes}
+        final_stretches_str = ''
+        for i, color in enumerate(COLORS):
+            if color in in_play:
+                final_stretches_str += f"{'=' * 45}{color}{'=' * 59}\n{fs_str_l[i]}\n{num_planes_str_l[i]}\n" \
+                                       f"{plane_color_str_l[i]}\n"
+
         return f'''
 =================================Main track==============================================================
 {entries_str}
@@ -163,152 +450,273 @@ class GameBoard:
 {num_planes_str}
 {plane_color_str}
 ========================================Final Stretches==================================================
-=============================================B===========================================================
-{fs_str_l[1]}
-{num_planes_str_l[1]}
-{plane_color_str_l[1]}
-=============================================G===========================================================
-{fs_str_l[3]}
-{num_planes_str_l[3]}
-{plane_color_str_l[3]}
-'''
-
-
-'''
-=================================Main track==============================================================
-{entries_str}
-{main_track_str}
-{num_planes_str}
-{plane_color_str}
-========================================Final Stretches==================================================
-==============================================R==========================================================
-{fs_str_l[0]}
-{num_planes_str_l[0]}
-{plane_color_str_l[0]}
-=============================================B===========================================================
-{fs_str_l[1]}
-{num_planes_str_l[1]}
-{plane_color_str_l[1]}
-=============================================Y===========================================================
-{fs_str_l[2]}
-{num_planes_str_l[2]}
-{plane_color_str_l[2]}
-=============================================G===========================================================
-{fs_str_l[3]}
-{num_planes_str_l[3]}
-{plane_color_str_l[3]}
-'''
+{final_stretches_str}'''
 
 
 class GameState:
-    def __init__(self, players, turn: int):
+    """
+    Plane positions are packed into a tuple of plane codes, planes of player i are at [i * NUM_PLANES, (i + 1) * NUM_PLANES).
+    Players, planes and gameboard are views built on demand for display and agents.
+    """
+
+    def __init__(self, players, turn: int, planes: tuple[int, ...] = None):
         self.die_roll = None
-        self.players = players
-        self.gameboard = GameBoard([plane for player in players for plane in player.planes])
+        self._players = players  # Game level players, shared by all successor states
+        self.colors = tuple(player.color for player in players)
         self.turn = turn
+        if planes is None:
+            planes = tuple(plane.code for player in players for plane in player.planes)
+        self.planes = planes
+        self.zobrist = zobrist_hash(planes, turn)  # Updated incrementally by moves
+        # Packed score components (see PLANE_COMPONENTS) of each player, updated incrementally by moves
+        self.components = tuple(sum(PLANE_COMPONENTS[code] for code in planes[i * NUM_PLANES:(i + 1) * NUM_PLANES])
+                                for i in range(len(players)))
+        # Board of the planes on each main track square (see SQUARE_FIELD), updated incrementally by moves
+        occupancy = 0
+        for i, code in enumerate(planes):
+            occupancy = occupy(occupancy, self.colors[i // NUM_PLANES], code)
+        self.occupancy = occupancy
+        self._views = None
+        self._mask = None
+        self._distinct = None
+
+    def _make_successor(self, turn: int, planes: tuple[int, ...], zobrist: int, components: tuple[int, ...],
+                        occupancy: int) -> Self:
+        succ_state = GameState.__new__(GameState)
+        succ_state.die_roll = None
+        succ_state._players = self._players
+        succ_state.colors = self.colors
+        succ_state.turn = turn
+        succ_state.planes = planes
+        succ_state.zobrist = zobrist
+        succ_state.components = components
+        succ_state.occupancy = occupancy
+        succ_state._views = None
+        succ_state._mask = None
+        succ_state._distinct = None
+        return succ_state
 
-    def get_movable_planes(self, die_v: int):
-        return self.players[self.turn].get_movable_planes(die_v)
+    def score_components(self, player: int) -> tuple[int, int, int, int]:
+        """
+        Finished count, hangar count, step sum and final stretch distance of a player's planes
+        """
+        return unpack_components(self.components[player])
+
+    def __getstate__(self):
+        # Views and move caches are rebuilt on demand
+        return {**self.__dict__, '_views': None, '_mask': None, '_distinct': None}
+
+    @property
+    def players(self):
+        if self._views is None:
+            self._views = []
+            for i, player in enumerate(self._players):
+                view = copy(player)
+                view.planes = [Plane.from_code(player.color, j, self.planes[i * NUM_PLANES + j])
+                               for j in range(NUM_PLANES)]
+                self._views.append(view)
+        return self._views
+
+    @property
+    def gameboard(self):
+        return GameBoard([plane for player in self.players for plane in player.planes])
+
+    def get_movable_planes(self, die_v: int) -> tuple[int, ...]:
+        if self._mask is None:
+            start = self.turn * NUM_PLANES
+            self._mask = sum(PLANE_CATEGORY[self.planes[start + j]] << 2 * j for j in range(NUM_PLANES))
+        return MOVABLE[self._mask][die_v]
+
+    def get_distinct_moves(self, die_v: int) -> tuple[int, ...]:
+        """
+        Movable planes with one plane (the first) of each position, moving any plane of planes sharing a position
+        (e.g. in the hangar) leads to equivalent states
+        """
+        if self._distinct is None:
+            self._distinct = {}
+        moves = self._distinct.get(die_v)
+        if moves is None:
+            moves = self._group_moves(die_v)
+        return moves[0]
+
+    def get_move_weights(self, die_v: int) -> tuple[int, ...]:
+        """
+        Number of movable planes sharing the position of each of get_distinct_moves, a uniformly random move is one
+        of the distinct moves with these weights
+        """
+        if self._distinct is None:
+            self._distinct = {}
+        moves = self._distinct.get(die_v)
+        if moves is None:
+            moves = self._group_moves(die_v)
+        return moves[1]
+
+    def _group_moves(self, die_v: int) -> tuple[tuple[int, ...], tuple[int, ...]]:
+        start = self.turn * NUM_PLANES
+        movable = self.get_movable_planes(die_v)
+        codes = [self.planes[start + a] for a in movable]
+        if len(set(codes)) == len(codes):
+            moves, weights = movable, UNIT_WEIGHTS[len(movable)]
+        else:
+            moves = tuple(a for k, a in enumerate(movable) if codes.index(codes[k]) == k)
+            weights = tuple(codes.count(self.planes[start + a]) for a in moves)
+        self._distinct[die_v] = moves, weights
+        return moves, weights
+
+    def get_chance_outcomes(self) -> tuple[tuple[int, int], ...]:
+        """
+        Die rolls of the player to move with distinct outcomes, each with the number of die rolls it stands for. Rolls
+        are equivalent when they keep or pass the turn alike and move the same positions the same way, all rolls
+        without a movable plane are equivalent.
+        """
+        start = self.turn * NUM_PLANES
+        key = (self.colors[self.turn], self.planes[start:start + NUM_PLANES])
+        outcomes = CHANCE_OUTCOMES.get(key)
+        if outcomes is None:
+            table = MOVE_TABLE[key[0]]
+            codes = sorted(set(key[1]))
+            groups = {}
+            for die_v in range(1, 7):
+                moves = tuple((code, table[code][die_v]) for code in codes if table[code][die_v] is not None)
+                group = (die_v == 6, moves) if moves else ()
+                if group in groups:
+                    groups[group][1] += 1
+                else:
+                    groups[group] = [die_v, 1]
+            outcomes = tuple((die_v, weight) for die_v, weight in groups.values())
+            if len(CHANCE_OUTCOMES) >= MAX_CHANCE_OUTCOMES:
+                CHANCE_OUTCOMES.clear()
+            CHANCE_OUTCOMES[key] = outcomes
+        return outcomes
 
     def generate_successor(self, action: [NoneType, int], die_v: int, show_event: bool = False) -> Self:
-        # Create new state
-        succ_state = GameState(deepcopy(self.players), self.turn)
+        return self._make_successor(*self._resolve_move(action, die_v, show_event))
+
+    def apply(self, action: [NoneType, int], die_v: int) -> tuple:
+        """
+        Play a move on this state in place, same rules as generate_successor. Return the undo record: the replaced
+        turn, planes, hashes and caches, which already hold any caught, jumped or bounced plane.
+        """
+        record = (self.turn, self.planes, self.zobrist, self.components, self.occupancy, self.die_roll, self._views,
+                  self._mask, self._distinct)
+        self.turn, self.planes, self.zobrist, self.components, self.occupancy = self._resolve_move(action, die_v)
+        self.die_roll = None
+        self._views = None
+        self._mask = None
+        self._distinct = None
+        return record
+
+    def undo(self, record: tuple):
+        """
+        Restore the state before the apply call that returned record, moves are undone in reverse order
+        """
+        self.turn, self.planes, self.zobrist, self.components, self.occupancy, self.die_roll, self._views, \
+            self._mask, self._distinct = record
+
+    def _resolve_move(self, action: [NoneType, int], die_v: int, show_event: bool = False) -> tuple:
+        """
+        Turn, planes, Zobrist hash, score components and occupancy after a move
+        """
+        planes = list(self.planes)
+        zobrist = self.zobrist
+        components = self.components
+        occupancy = self.occupancy
         event_log = ""
-        cur_player = succ_state.players[succ_state.turn]
+        color = self.colors[self.turn]
         if action is not None:
+            components = list(components)
             # Move plane
-            plane_moved = cur_player.planes[action]
-            plane_moved.move(die_v)
+            slot = self.turn * NUM_PLANES + action
+            move = MOVE_TABLE[color][planes[slot]][die_v]
+            if STACK_BLOCKS:
+                blocked = blocked_move(move, planes[slot], die_v, lambda p: is_stacked(occupancy, color, p))
+                if blocked is not move:
+                    if show_event:
+                        event_log += f"{Fore.RED}{color} player's plane {action} was blocked!{Style.RESET_ALL}\n"
+                    move = blocked
+            code, jump, catch_squares, catch_final = move
+            zobrist += ZOBRIST_PLANES[slot][code] - ZOBRIST_PLANES[slot][planes[slot]]
+            components[self.turn] += PLANE_COMPONENTS[code] - PLANE_COMPONENTS[planes[slot]]
+            # The plane leaves its square, then takes the square it ends on once the planes there are caught
+            occupancy -= SQUARE_BITS[color][planes[slot]]
+            planes[slot] = code
 
             # Can catch planes both before and after jump
-            pos = plane_moved.pos
-
-            # catching planes
-            caught_plane, inx = self.catch_planes(succ_state, plane_moved, pos)
-            if caught_plane:
-                event_log += f"{Fore.RED}{cur_player.color} player's plane {plane_moved.ind} caught {OPPONENT[cur_player.color]} " \
-                             f"player's plane {inx}!{Style.RESET_ALL}\n"
-
-            # Handle jump
-            if plane_moved.is_on_main_track() and \
-                    succ_state.gameboard.squares[pos].color == plane_moved.color:  # Jump
-                if succ_state.gameboard.squares[pos].is_jump_point() or \
-                        succ_state.gameboard.squares[(pos + 4) % NUM_SQUARES].is_jump_point():  # Jump point
-                    plane_moved.move(16)
-                    event_log += f"{Fore.RED}{cur_player.color} player's plane {plane_moved.ind} took a big jump!{Style.RESET_ALL}\n"
-                    # catch opponent planes on final stretch
-                    opponent = succ_state.get_opponent(cur_player)
-                    for plane in opponent.planes:
-                        if plane.is_on_final_stretch() and plane.pos == 3:
-                            plane_moved.catch_plane(plane)
-                            event_log += f"{Fore.RED}{cur_player.color} player's plane {plane_moved.ind} catched {plane.color} " \
-                                         f"player's plane {plane.ind}!{Style.RESET_ALL}\n"
-                else:
-                    plane_moved.move(4)
-                    event_log += f"{Fore.RED}{cur_player.color} player's plane {plane_moved.ind} took a jump!{Style.RESET_ALL}\n"
-            # Update pos
-            pos = plane_moved.pos
-            # catching planes
-            caught_plane, inx = self.catch_planes(succ_state, plane_moved, pos)
-            if caught_plane:
-                event_log += f"{Fore.RED}{cur_player.color} player's plane {plane_moved.ind} caught {OPPONENT[cur_player.color]} " \
-                            f"player's plane {inx}!{Style.RESET_ALL}\n"
+            for pos in catch_squares:
+                occupancy, caught = catch_planes(planes, occupancy, self.colors, color, pos)
+                if caught:
+                    for i, caught_code in caught:
+                        zobrist += ZOBRIST_PLANES[i][HANGAR] - ZOBRIST_PLANES[i][caught_code]
+                        components[i // NUM_PLANES] += PLANE_COMPONENTS[HANGAR] - PLANE_COMPONENTS[caught_code]
+                    if show_event:
+                        event_log += f"{Fore.RED}{color} player's plane {action} caught " \
+                                     f"{self.colors[caught[0][0] // NUM_PLANES]} player's plane " \
+                                     f"{[i % NUM_PLANES for i, _ in caught]}!{Style.RESET_ALL}\n"
+            # occupy(occupancy, color, code) inlined, this runs for every searched move
+            occupancy = (occupancy & ~OWNER_MASK[color][code] | OWNER_BITS[color][code]) + SQUARE_BITS[color][code]
+            # The event log is only built to be shown, searches resolve moves without it
+            if show_event and jump == BIG_JUMP:
+                event_log += f"{Fore.RED}{color} player's plane {action} took a big jump!{Style.RESET_ALL}\n"
+            elif show_event and jump == JUMP:
+                event_log += f"{Fore.RED}{color} player's plane {action} took a jump!{Style.RESET_ALL}\n"
+            # catch opponent planes on final stretch
+            if catch_final and OPPONENT[color] in self.colors:
+                opponent = self.colors.index(OPPONENT[color])
+                for i in range(opponent * NUM_PLANES, (opponent + 1) * NUM_PLANES):
+                    if planes[i] == FINAL_BASE + 3:
+                        zobrist += ZOBRIST_PLANES[i][HANGAR] - ZOBRIST_PLANES[i][FINAL_BASE + 3]
+                        components[opponent] += PLANE_COMPONENTS[HANGAR] - PLANE_COMPONENTS[FINAL_BASE + 3]
+                        planes[i] = HANGAR
+                        if show_event:
+                            event_log += f"{Fore.RED}{color} player's plane {action} catched " \
+                                         f"{OPPONENT[color]} player's plane {i % NUM_PLANES}!{Style.RESET_ALL}\n"
             # Check if finished
-            if plane_moved.is_finished():
-                event_log += f"{Fore.RED}{cur_player} player got a plane finished!\n"
+            if show_event and code == FINISH:
+                event_log += f"{Fore.RED}{color} player got a plane finished!\n"
+            components = tuple(components)
 
         if show_event:
             print(event_log)
 
         if die_v != 6:
-            new_turn = (succ_state.turn + 1) % len(succ_state.players)  # Next player
+            new_turn = (self.turn + 1) % len(self.colors)  # Next player
         else:
-            new_turn = succ_state.turn
-        succ_state.turn = new_turn
+            new_turn = self.turn
+        zobrist = (zobrist + ZOBRIST_TURN[new_turn] - ZOBRIST_TURN[self.turn]) & ZOBRIST_MASK
 
-        return succ_state
+        return new_turn, tuple(planes), zobrist, components, occupancy
 
-    @staticmethod
-    def catch_planes(succ_state, plane_moved: Plane, pos: int):
-        other_planes = succ_state.get_planes(pos)
-        caught_plane = False
-        inx = []
-        if len(other_planes) > 0:
-            caught_plane = True
-            for plane in other_planes:
-                inx.append(plane.ind)
-                plane_moved.catch_plane(plane)
-        return caught_plane, inx
+    def is_stacked(self, occupancy: int, turn: int, pos: int) -> bool:
+        """
+        Whether another player than turn has 2 or more planes on main track square pos
+        """
+        return is_stacked(occupancy, self.colors[turn], pos)
 
     def get_opponent(self, cur_player):
-        if cur_player.color == 'B':
-            for player in self.players:
-                if player.color == 'G':
-                    return player
-        elif cur_player.color == 'G':
-            for player in self.players:
-                if player.color == 'B':
-                    return player
-        else:
-            raise NotImplemented("Not implemented for other colors yet")
+        """
+        Player whose final stretch the big jump of cur_player crosses, None if that color is not playing
+        """
+        for player in self.players:
+            if player.color == OPPONENT[cur_player.color]:
+                return player
+        return None
 
     def get_planes(self, pos: int):
-        planes = []
-        for i in range(len(self.players)):
-            if i != self.turn:
-                for plane in self.players[i].planes:
-                    if plane.is_on_main_track() and plane.pos == pos:
-                        planes.append(plane)
-        return planes
+        """
+        Planes of another player than the one to move on main track square pos
+        """
+        if not square_count(self.occupancy, pos) or square_owner(self.occupancy, pos) == self.colors[self.turn]:
+            return []
+        player = self.players[self.colors.index(square_owner(self.occupancy, pos))]
+        return [plane for plane in player.planes if plane.is_on_main_track() and plane.pos == pos]
 
     def is_win(self, color: str):
-        for player in self.players:
-            if player.color == color:
-                return player.get_remaining_planes_count() == 0
+        i = self.colors.index(color)
+        return self.planes[i * NUM_PLANES:(i + 1) * NUM_PLANES].count(FINISH) == NUM_PLANES
 
     def is_lose(self, color: str):
-        for player in self.players:
-            if player.color != color and player.get_remaining_planes_count() == 0:
+        for i, other in enumerate(self.colors):
+            if other != color and self.planes[i * NUM_PLANES:(i + 1) * NUM_PLANES].count(FINISH) == NUM_PLANES:
                 return True
         return False
 
@@ -316,15 +724,8 @@ class GameState:
         return self.players[self.turn]
 
     def __hash__(self):
-        return hash(tuple([self.turn, self.die_roll] + [player for player in self.players]))
+        return self.zobrist ^ ZOBRIST_DIE[self.die_roll or 0]
 
     def __eq__(self, other: Self):
         # Equal if plane positions and types are the same
-        if self.turn != other.turn or self.die_roll != other.die_roll:
-            return False
-
-        for i, p1 in enumerate(self.players):
-            p2 = other.players[i]
-            if p1 != p2:
-                return False
-        return True
+        return self.turn == other.turn and self.die_roll == other.die_roll and self.planes == other.planes
@@ -0,0 +1,161 @@
+import json
+import mmap
+import struct
+from types import NoneType
+
+from Game import Player, AGENTS
+from GameBoard import GameState, NUM_PLANES
+from utils import STACK_BLOCKS
+
+# File: FILE_HEADER, games, then the index and INDEX_FOOTER once the writer is closed.
+# Game: GAME_HEADER, agents (JSON: name and constructor parameters of each agent, and the rule variant), player
+# colors, initial turn and planes, then one fixed-width record per ply: die, action (NO_ACTION when no plane moved),
+# turn and planes after the move. Games of version 1 files have comma separated agent names instead of the JSON.
+FILE_MAGIC = b'AGR2'
+FILE_MAGIC_V1 = b'AGR1'
+FILE_HEADER = struct.Struct('<4s')
+GAME_MAGIC = b'GAME'
+GAME_HEADER = struct.Struct('<4sQBBIH')  # magic, seed, players, winner, plies, agents length
+INDEX_ENTRY = struct.Struct('<QI')  # game offset, plies
+INDEX_MAGIC = b'AGRI'
+INDEX_FOOTER = struct.Struct('<QI4s')  # index offset, games, magic
+NO_ACTION = 255
+NO_WINNER = 255
+
+
+def ply_struct(num_players: int) -> struct.Struct:
+    return struct.Struct(f'<BBB{num_players * NUM_PLANES}B')
+
+
+class GameRecorder:
+    """
+    Encodes the plies of one game, the bytes are written to a file by GameRecordWriter
+    """
+
+    def __init__(self, seed: int, agents: list[str], state: GameState):
+        self.seed = seed
+        params = [player.agent.params() for player in state._players]
+        self.agents = json.dumps({'agents': [{'name': name, 'params': p} for name, p in zip(agents, params)],
+                                  'stack_blocks': STACK_BLOCKS}, separators=(',', ':')).encode()
+        self.colors = ''.join(state.colors).encode()
+        self.ply = ply_struct(len(state.colors))
+        self.plies = 0
+        self.records = bytearray(self.ply.pack(0, NO_ACTION, state.turn, *state.planes))
+
+    def record_ply(self, die_v: int, action: [NoneType, int], state: GameState):
+        self.records += self.ply.pack(die_v, NO_ACTION if action is None else action, state.turn, *state.planes)
+        self.plies += 1
+
+    def finish(self, winner: [NoneType, str]) -> bytes:
+        colors = self.colors.decode()
+        header = GAME_HEADER.pack(GAME_MAGIC, self.seed, len(colors),
+                                  NO_WINNER if winner is None else colors.index(winner), self.plies, len(self.agents))
+        return header + self.agents + self.colors + self.records
+
+
+class GameRecordWriter:
+    """
+    Appends encoded games to a file through a large write buffer, close() writes the seek index
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 20):
+        self.file = open(path, 'wb', buffering=buffer_size)
+        self.file.write(FILE_HEADER.pack(FILE_MAGIC))
+        self.offset = FILE_HEADER.size
+        self.index = []
+
+    def write_game(self, data: bytes):
+        self.index.append((self.offset, GAME_HEADER.unpack_from(data)[4]))
+        self.file.write(data)
+        self.offset += len(data)
+
+    def close(self):
+        if self.file.closed:
+            return
+        for offset, plies in self.index:
+            self.file.write(INDEX_ENTRY.pack(offset, plies))
+        self.file.write(INDEX_FOOTER.pack(self.offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameRecordReader:
+    """
+    Random access to the plies of a game record file. Files without an index (the writer was not closed) are indexed
+    by skipping from game header to game header.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = FILE_HEADER.unpack_from(self.data)[0]
+        if magic not in (FILE_MAGIC, FILE_MAGIC_V1):
+            raise ValueError(f"{path} is not a game record file")
+        self.version = 1 if magic == FILE_MAGIC_V1 else 2
+        self.index = self._read_index()
+
+    def _read_index(self) -> list[tuple[int, int]]:
+        if len(self.data) >= FILE_HEADER.size + INDEX_FOOTER.size:
+            index_offset, games, magic = INDEX_FOOTER.unpack_from(self.data, len(self.data) - INDEX_FOOTER.size)
+            if magic == INDEX_MAGIC:
+                return [INDEX_ENTRY.unpack_from(self.data, index_offset + i * INDEX_ENTRY.size) for i in range(games)]
+        index = []
+        offset = FILE_HEADER.size
+        while offset + GAME_HEADER.size <= len(self.data):
+            magic, _, num_players, _, plies, agents_len = GAME_HEADER.unpack_from(self.data, offset)
+            size = GAME_HEADER.size + agents_len + num_players + (plies + 1) * ply_struct(num_players).size
+            if magic != GAME_MAGIC or offset + size > len(self.data):
+                break  # Truncated game
+            index.append((offset, plies))
+            offset += size
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    def header(self, game: int) -> dict:
+        offset, _ = self.index[game]
+        _, seed, num_players, winner, plies, agents_len = GAME_HEADER.unpack_from(self.data, offset)
+        start = offset + GAME_HEADER.size
+        colors = self.data[start + agents_len:start + agents_len + num_players].decode()
+        agents = self.data[start:start + agents_len].decode()
+        if self.version == 1:
+            names, params, stack_blocks = agents.split(','), [{}] * num_players, None
+        else:
+            agents = json.loads(agents)
+            names = [agent['name'] for agent in agents['agents']]
+            params = [agent['params'] for agent in agents['agents']]
+            stack_blocks = agents['stack_blocks']
+        return {'seed': seed, 'agents': names, 'params': params, 'stack_blocks': stack_blocks, 'colors': colors,
+                'winner': None if winner == NO_WINNER else colors[winner], 'plies': plies}
+
+    def ply(self, game: int, ply: int) -> tuple[[NoneType, int], [NoneType, int], int, tuple[int, ...]]:
+        """
+        Die, action, turn and planes after ply (1 to plies), ply 0 is the initial state without die and action
+        """
+        offset, plies = self.index[game]
+        if not 0 <= ply <= plies:
+            raise IndexError(f"Game {game} has {plies} plies")
+        _, _, num_players, _, _, agents_len = GAME_HEADER.unpack_from(self.data, offset)
+        record = ply_struct(num_players)
+        values = record.unpack_from(self.data, offset + GAME_HEADER.size + agents_len + num_players + ply * record.size)
+        die_v, action, turn = values[:3]
+        return die_v or None, None if action == NO_ACTION else action, turn, values[3:]
+
+    def state(self, game: int, ply: int) -> GameState:
+        """
+        Game state after ply, with the game's agents as players, built with their recorded parameters
+        """
+        header = self.header(game)
+        _, _, turn, planes = self.ply(game, ply)
+        players = [Player(color, AGENTS[name](color, **params))
+                   for color, name, params in zip(header['colors'], header['agents'], header['params'])]
+        return GameState(players, turn, planes)
+
+    def close(self):
+        self.data.close()
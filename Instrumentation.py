@@ -0,0 +1,142 @@
+import time
+from collections import Counter
+from math import frexp, inf
+from types import NoneType
+
+from typing_extensions import Self
+
+# Timing of every instrumented phase, monotonic and high resolution
+clock = time.perf_counter
+
+
+class DecisionStats:
+    """
+    Search statistics of one get_action call, filled in by the agent while its hook is set
+    """
+
+    def __init__(self, agent: str):
+        self.agent = agent
+        self.time = 0.0
+        self.nodes = 0  # Nodes expanded
+        self.leaves = 0  # Leaf evaluations (Expectimax) or rollouts (MCTS)
+        self.max_depth = 0
+        self.phases = {}  # Seconds spent in each search phase, e.g. MCTS select/expand/simulate/backpropagate
+        self.cache_lookups = 0
+        self.cache_hits = 0
+
+    def add_phase(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @property
+    def branching(self) -> float:
+        """
+        Effective branching factor: b with 1 + b + ... + b^max_depth = nodes + 1, for a uniform tree as large
+        as the search
+        """
+        if self.nodes == 0 or self.max_depth == 0:
+            return 0.0
+        lo, hi = 0.0, float(self.nodes)
+        for _ in range(50):
+            b = (lo + hi) / 2
+            if sum(b ** d for d in range(1, self.max_depth + 1)) < self.nodes:
+                lo = b
+            else:
+                hi = b
+        return (lo + hi) / 2
+
+    @property
+    def cache_hit_rate(self) -> [NoneType, float]:
+        return self.cache_hits / self.cache_lookups if self.cache_lookups > 0 else None
+
+    def metrics(self) -> dict[str, float]:
+        metrics = {'time': self.time, 'nodes': self.nodes, 'leaves': self.leaves, 'max_depth': self.max_depth,
+                   'branching': self.branching}
+        if self.cache_hit_rate is not None:
+            metrics['cache_hit_rate'] = self.cache_hit_rate
+        for phase, seconds in self.phases.items():
+            metrics[f'{phase}_time'] = seconds
+        return metrics
+
+
+class DecisionHook:
+    """
+    Receives the stats of every decision of the agents it is set on (AeroplaneChessAgent.hook),
+    agents without a hook skip instrumentation
+    """
+
+    def record(self, stats: DecisionStats):
+        raise NotImplementedError
+
+
+class Histogram:
+    """
+    Counts of values in power of 2 buckets, bucket e holds values in [2^(e-1), 2^e)
+    """
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = inf
+        self.max = -inf
+
+    def add(self, value: float):
+        self.buckets[frexp(value)[1] if value > 0 else None] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: Self):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper edge of the bucket holding the q quantile
+        """
+        seen = 0
+        for e in sorted(self.buckets, key=lambda e: -inf if e is None else e):
+            seen += self.buckets[e]
+            if seen >= q * self.count:
+                return 0.0 if e is None else min(2.0 ** e, self.max)
+        return self.max
+
+    def __repr__(self):
+        if self.count == 0:
+            return "empty"
+        return f"n={self.count} mean={self.total / self.count:.4g} p50<={self.percentile(0.5):.4g} " \
+               f"p90<={self.percentile(0.9):.4g} max={self.max:.4g}"
+
+
+class HistogramSink(DecisionHook):
+    """
+    Histograms of every decision metric per agent, merged across the processes of a tournament
+    """
+
+    def __init__(self):
+        self.histograms = {}  # agent -> metric -> Histogram
+
+    def record(self, stats: DecisionStats):
+        histograms = self.histograms.setdefault(stats.agent, {})
+        for metric, value in stats.metrics().items():
+            histograms.setdefault(metric, Histogram()).add(value)
+
+    def merge(self, other: Self):
+        for agent, histograms in other.histograms.items():
+            for metric, histogram in histograms.items():
+                self.histograms.setdefault(agent, {}).setdefault(metric, Histogram()).merge(histogram)
+
+    def clear(self):
+        self.histograms = {}
+
+    def report(self) -> str:
+        lines = []
+        for agent, histograms in self.histograms.items():
+            lines.append(f"{agent}:")
+            for metric, histogram in histograms.items():
+                lines.append(f"  {metric}: {histogram}")
+        return '\n'.join(lines)
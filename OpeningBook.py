@@ -0,0 +1,171 @@
+import bisect
+import mmap
+import os
+import struct
+import time
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from GameBoard import GameState, NUM_PLANES, pack_state
+from utils import OPENING_BOOK_PATH, OPENING_BOOK_PLIES, STACK_BLOCKS
+
+# Best action of every early-game decision (a state and die roll with a movable plane) of games between COLORS
+# started by player 0. Keys are pack_state of the state with each player's planes sorted, so plane order
+# doesn't matter, sorted for binary search, followed by the code of the plane to move for each key.
+COLORS = ('B', 'G')
+HEADER = struct.Struct('<4sBB2sI4x')  # magic, plies, key bytes, colors, entries, padding to align the keys
+MAGIC = b'AEOB'
+KEY_FORMAT = 'Q'
+
+
+def book_key(state: GameState, die_v: int) -> int:
+    planes = [code for i in range(len(state.colors))
+              for code in sorted(state.planes[i * NUM_PLANES:(i + 1) * NUM_PLANES])]
+    return pack_state(planes, state.turn, die_v)
+
+
+class OpeningBook:
+    """
+    Memory mapped opening book written by build_book, keys and actions are read from the file on lookup
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.plies, key_bytes, colors, n = HEADER.unpack_from(self.data)
+        if magic != MAGIC or key_bytes != struct.calcsize(KEY_FORMAT) or colors.decode() != ''.join(COLORS):
+            raise ValueError(f"{path} is not an opening book of this engine")
+        view = memoryview(self.data)
+        self.keys = view[HEADER.size:HEADER.size + n * key_bytes].cast(KEY_FORMAT)
+        self.codes = view[HEADER.size + n * key_bytes:HEADER.size + n * (key_bytes + 1)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def action(self, state: GameState, die_v: int):
+        """
+        Book action of the player to move in state with die_v, None if the decision is not in the book
+        """
+        if state.colors != COLORS:
+            return None
+        key = book_key(state, die_v)
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        start = state.turn * NUM_PLANES
+        return state.planes.index(self.codes[i], start, start + NUM_PLANES) - start
+
+    def close(self):
+        self.keys.release()
+        self.codes.release()
+        self.data.close()
+
+
+_book = None
+
+
+def get_opening_book():
+    """
+    Book at OPENING_BOOK_PATH, opened on first use. None if it has not been built or the stacked-plane rule variant
+    is played.
+    """
+    global _book
+    if _book is None and not STACK_BLOCKS and os.path.exists(OPENING_BOOK_PATH):
+        _book = OpeningBook(OPENING_BOOK_PATH)
+    return _book
+
+
+def book_positions(plies: int) -> list[tuple[GameState, int]]:
+    """
+    Decisions reachable in the first plies of a game, each state once whatever the order of the players' planes
+    """
+    # The builder plays with agents, which look up the book through this module
+    from Game import Player
+
+    players = [Player(color) for color in COLORS]
+    level = [GameState(players, 0)]
+    seen = set()
+    positions = []
+    for _ in range(plies):
+        next_level = {}
+        for state in level:
+            for die_v in range(1, 7):
+                moves = state.get_distinct_moves(die_v)
+                key = book_key(state, die_v)
+                if len(moves) > 0 and key not in seen:
+                    seen.add(key)
+                    positions.append((state, die_v))
+                for a in moves or (None,):
+                    succ = state.generate_successor(a, die_v)
+                    next_level.setdefault(book_key(succ, 0), succ)
+        level = list(next_level.values())
+    return positions
+
+
+def _search_task(task):
+    """
+    Book action code of each position of a chunk, searched by a fresh agent per player that ignores the book unless
+    the move is forced
+    """
+    from Agent import ExpectimaxAgent, MCTSAgent
+
+    agent_name, depth, iterations, positions = task
+    agents = {}
+    codes = []
+    for state, die_v in positions:
+        moves = state.get_distinct_moves(die_v)
+        if len(moves) == 1:
+            codes.append(state.planes[state.turn * NUM_PLANES + moves[0]])
+            continue
+        color = state.colors[state.turn]
+        if color not in agents:
+            if agent_name == 'Expectimax':
+                agents[color] = ExpectimaxAgent(color, time_limit=None, depth=depth, frontier_depth=depth - 1)
+            else:
+                agents[color] = MCTSAgent(color, iterations=iterations, workers=1)
+            agents[color].use_book = False
+        action = agents[color].get_action(state, die_v)
+        codes.append(state.planes[state.turn * NUM_PLANES + action])
+    return codes
+
+
+def build_book(plies: int = OPENING_BOOK_PLIES, agent: str = 'Expectimax', depth: int = 4, iterations: int = 5000,
+               workers: int = None, chunk_size: int = 200) -> dict[int, int]:
+    """
+    Search every book decision with a deep Expectimax search or a long MCTS search, return key -> plane code to move
+    """
+    positions = book_positions(plies)
+    chunks = [positions[i:i + chunk_size] for i in range(0, len(positions), chunk_size)]
+    tasks = [(agent, depth, iterations, chunk) for chunk in chunks]
+    with Pool(workers) as pool:
+        codes = [code for chunk_codes in pool.map(_search_task, tasks) for code in chunk_codes]
+    return {book_key(state, die_v): code for (state, die_v), code in zip(positions, codes)}
+
+
+def save_book(path: str, book: dict[int, int], plies: int):
+    keys = sorted(book)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, plies, struct.calcsize(KEY_FORMAT), ''.join(COLORS).encode(), len(keys)))
+        f.write(struct.pack(f'<{len(keys)}{KEY_FORMAT}', *keys))
+        f.write(bytes(book[key] for key in keys))
+
+
+def main():
+    parser = ArgumentParser(description="Build the opening book of the early-game decisions")
+    parser.add_argument('--plies', type=int, default=OPENING_BOOK_PLIES, help="Plies from the start of the game")
+    parser.add_argument('--agent', default='Expectimax', choices=['Expectimax', 'MCTS'])
+    parser.add_argument('--depth', type=int, default=4, help="Expectimax search depth")
+    parser.add_argument('--iterations', type=int, default=5000, help="MCTS iterations")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=OPENING_BOOK_PATH)
+    args = parser.parse_args()
+
+    start = time.time()
+    book = build_book(args.plies, args.agent, args.depth, args.iterations, args.workers)
+    save_book(args.output, book, args.plies)
+    print(f"{len(book)} decisions of the first {args.plies} plies in {time.time() - start:.1f}s, "
+          f"written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
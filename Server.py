@@ -0,0 +1,282 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from Agent import ExpectimaxAgent, MCTSAgent, RandomAgent
+from Game import Game, Player, AGENTS
+from GameBoard import GameState
+from utils import PLAYER_COLORS, COLORS
+
+# Agents whose get_action runs in the executor, the others are cheap enough to run on the event loop
+EXPENSIVE_AGENTS = (ExpectimaxAgent, MCTSAgent)
+EXPENSIVE_NAMES = {name for name, agent in AGENTS.items() if issubclass(agent, EXPENSIVE_AGENTS)}
+# Constructor arguments of the server's agents by name, small caches as thousands of them may be alive at once
+SERVER_AGENT_PARAMS = {
+    'Expectimax': {'max_entries': 10000},
+    'MCTS': {'workers': 1, 'max_free_nodes': 1000},
+}
+# Agents kept by each executor process between moves, least recently used first. The agents of a finished match
+# are dropped by the processes holding them with their next move.
+MAX_WORKER_AGENTS = 256
+
+_worker_agents = OrderedDict()  # (match, color) -> agent, in executor processes
+
+
+def _timed_action(agent, state: GameState, die_v: int, time_limit: float):
+    if isinstance(agent, EXPENSIVE_AGENTS):
+        # Search until the time limit instead of being abandoned at the timeout
+        return agent.get_action(state, die_v, deadline=time.monotonic() + time_limit)
+    return agent.get_action(state, die_v)
+
+
+def _decide_task(key: tuple[int, str], name: str, state: GameState, die_v: int, time_limit: float,
+                 released: dict[int, tuple[int, ...]]):
+    """
+    get_action of the match's agent in an executor process, the agent and its caches live on between moves. First
+    drop the agents of the finished matches released to this process (by pid). Return the pid and the action.
+    """
+    for match_id in released.get(os.getpid(), ()):
+        for color in COLORS:
+            _worker_agents.pop((match_id, color), None)
+    agent = _worker_agents.get(key)
+    if agent is None:
+        agent = AGENTS[name](key[1], **SERVER_AGENT_PARAMS.get(name, {}))
+        _worker_agents[key] = agent
+        if len(_worker_agents) > MAX_WORKER_AGENTS:
+            _worker_agents.popitem(last=False)
+    else:
+        _worker_agents.move_to_end(key)
+    return os.getpid(), _timed_action(agent, state, die_v, time_limit)
+
+
+class Match:
+    def __init__(self, match_id: int, agents: list[str], seed: int, remote: bool = False):
+        """
+        remote: the expensive agents live in executor processes, the game holds a RandomAgent in their place
+        """
+        self.id = match_id
+        self.agents = agents
+        self.seed = seed
+        self.rng = random.Random(seed)  # Dice of this match, independent of the other matches
+        local = ['Random' if remote and name in EXPENSIVE_NAMES else name for name in agents]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.game = Game(num_players=len(agents), agents=local, agent_params=SERVER_AGENT_PARAMS)
+        # Players without search state, sent to executor processes with the game state
+        self.bare_players = [Player(color) for color in self.game.state.colors]
+        self.plies = 0
+        self.fallbacks = 0
+        self.running = {}  # color -> executor future of the agent's last move, which may outlive its timeout
+        self.workers = set()  # pids of the executor processes holding agents of this match
+        self.closed = False
+
+    def close(self):
+        """
+        Drop the search state of the match's local agents once it is over, the game state stays for the state op
+        """
+        self.closed = True
+        for player in self.game.state._players:
+            if isinstance(player.agent, EXPENSIVE_AGENTS):
+                player.agent = RandomAgent(player.color)
+
+    def summary(self) -> dict:
+        state = self.game.state
+        return {'match': self.id, 'agents': self.agents, 'seed': self.seed, 'plies': self.plies,
+                'fallbacks': self.fallbacks, 'planes': list(state.planes), 'turn': state.turn,
+                'over': self.game.is_over, 'winner': self.game.winner}
+
+
+class MatchServer:
+    """
+    Plays matches requested over a JSON lines protocol on a local socket, each match is an asyncio task.
+
+    Requests:
+    * {"op": "start", "agents": ["Expectimax", "Random"], "seed": 1, "watch": false}: start a match of 2 to 4
+      players in turn order (see PLAYER_COLORS), replies
+      {"event": "started", "match": id}, then {"event": "ply", ...} for every move if watched, and
+      {"event": "finished", ...} with the winner, or {"event": "error", "match": id, ...} if the match failed
+    * {"op": "state", "match": id}: current state of a match
+    * {"op": "stats"}: running and finished match counts
+    """
+
+    def __init__(self, workers: int = None, executor: str = 'process', move_timeout: float = 1.0):
+        self.move_timeout = move_timeout
+        self.use_processes = executor == 'process'
+        self.executor = ProcessPoolExecutor(workers) if self.use_processes else ThreadPoolExecutor(workers)
+        self.fallback = RandomAgent('B')
+        self.matches = {}
+        self.next_id = 0
+        self.finished = 0
+        # pid -> finished matches whose agents the executor process drops with its next move
+        self.released = {}
+
+    async def decide(self, match: Match, die_v: int) -> tuple:
+        """
+        Action of the player to move and whether the fallback RandomAgent chose it because the agent timed out or
+        was still busy with its last timed out move
+        """
+        state = match.game.state
+        agent = state.players[state.turn].agent
+        color = state.colors[state.turn]
+        if match.agents[state.turn] not in EXPENSIVE_NAMES:
+            return agent.get_action(state, die_v), False
+
+        running = match.running.get(color)
+        if running is not None and not running.done():
+            # The agent (and its worker) is still busy with a timed out move, it never searches two moves at once
+            return self.fallback.get_action(state, die_v), True
+        if self.use_processes:
+            bare_state = GameState(match.bare_players, state.turn, state.planes)
+            released = {pid: tuple(match_ids) for pid, match_ids in self.released.items()}
+            future = self.executor.submit(_decide_task, (match.id, color), match.agents[state.turn], bare_state, die_v,
+                                          self.move_timeout * 0.8, released)
+            loop = asyncio.get_running_loop()
+            future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._worker_done, match, released, f))
+            result = asyncio.wrap_future(future, loop=loop)
+        else:
+            # Searches apply moves to the state they are given, a timed out search must not touch the match state
+            search_state = GameState(state._players, state.turn, state.planes)
+            future = self.executor.submit(_timed_action, agent, search_state, die_v, self.move_timeout * 0.8)
+            result = asyncio.wrap_future(future)
+        match.running[color] = future
+        try:
+            # A move still queued at the timeout is cancelled, a running one ends at its deadline
+            result = await asyncio.wait_for(result, self.move_timeout)
+        except asyncio.TimeoutError:
+            return self.fallback.get_action(state, die_v), True
+        return (result[1] if self.use_processes else result), False
+
+    def _worker_done(self, match: Match, released: dict[int, tuple[int, ...]], future):
+        """
+        Note which executor process holds the agent of a finished move, and the releases it has applied
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+        pid, _ = future.result()
+        pending = self.released.get(pid)
+        if pending is not None:
+            pending.difference_update(released.get(pid, ()))
+            if len(pending) == 0:
+                del self.released[pid]
+        if match.closed:  # A timed out move that finished after the match
+            self.released.setdefault(pid, set()).add(match.id)
+        else:
+            match.workers.add(pid)
+
+    async def play(self, match: Match, send):
+        game = match.game
+        while not game.is_over:
+            state = game.state
+            color = state.colors[state.turn]
+            player = state.players[state.turn]
+            die_v = match.rng.randint(1, 6)
+            state.die_roll = die_v
+            start = time.perf_counter()
+            action, fallback = await self.decide(match, die_v)
+            player.decision_time_record.append(time.perf_counter() - start)
+            with contextlib.redirect_stdout(io.StringIO()):
+                game.apply_move(action, die_v)
+            match.plies += 1
+            match.fallbacks += fallback
+            if send is not None:
+                await send({'event': 'ply', 'match': match.id, 'ply': match.plies, 'color': color, 'die': die_v,
+                            'action': action, 'fallback': fallback})
+            # Let the other matches move, inline agents never wait
+            await asyncio.sleep(0)
+        return match
+
+    async def run_match(self, match: Match, send, watch: bool):
+        try:
+            await self.play(match, send if watch else None)
+            await send({'event': 'finished', **match.summary()})
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            # The match is abandoned, the client is told instead of waiting for it to finish
+            await send({'event': 'error', 'match': match.id, 'message': f"{type(e).__name__}: {e}"})
+        finally:
+            self.finished += 1
+            match.close()
+            for pid in match.workers:
+                self.released.setdefault(pid, set()).add(match.id)
+
+    async def handle(self, request: dict, send, tasks: set):
+        op = request.get('op')
+        if op == 'start':
+            agents = request.get('agents', ['Expectimax', 'Random'])
+            if len(agents) not in PLAYER_COLORS or any(name not in AGENTS for name in agents):
+                raise ValueError(f"agents must be {min(PLAYER_COLORS)} to {max(PLAYER_COLORS)} of {list(AGENTS)}")
+            match = Match(self.next_id, agents, request.get('seed', random.getrandbits(32)), self.use_processes)
+            self.next_id += 1
+            self.matches[match.id] = match
+            await send({'event': 'started', 'match': match.id})
+            task = asyncio.create_task(self.run_match(match, send, request.get('watch', False)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        elif op == 'state':
+            match = self.matches.get(request.get('match'))
+            if match is None:
+                raise ValueError(f"Unknown match {request.get('match')}")
+            await send({'event': 'state', **match.summary()})
+        elif op == 'stats':
+            await send({'event': 'stats', 'running': self.next_id - self.finished, 'finished': self.finished})
+        else:
+            raise ValueError(f"Unknown op {op}")
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def send(message: dict):
+            async with lock:
+                writer.write(json.dumps(message).encode() + b'\n')
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                try:
+                    await self.handle(json.loads(line), send, tasks)
+                except (ValueError, TypeError, KeyError) as e:
+                    await send({'event': 'error', 'message': str(e)})
+            # Finish the client's matches before closing
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765):
+        server = await asyncio.start_server(self.serve_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = ArgumentParser(description="Serve matches between agents over a JSON lines socket protocol")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help="Executor workers for Expectimax and MCTS moves")
+    parser.add_argument('--executor', default='process', choices=['process', 'thread'])
+    parser.add_argument('--move-timeout', type=float, default=1.0,
+                        help="Seconds per executor move before RandomAgent moves instead")
+    args = parser.parse_args()
+
+    server = MatchServer(args.workers, args.executor, args.move_timeout)
+    print(f"Serving matches on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
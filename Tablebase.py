@@ -0,0 +1,211 @@
+import mmap
+import os
+import struct
+import time
+from argparse import ArgumentParser
+from itertools import combinations_with_replacement
+from math import comb
+
+import numpy as np
+
+from GameBoard import GameState, MOVE_TABLE, MAIN_SQUARE, NUM_PLANES, HANGAR, FINAL_BASE, FINISH
+from utils import OPPONENT, STACK_BLOCKS, TABLEBASE_PATH, TABLEBASE_PLANES
+
+# Two player endgames where each player has at most max_planes unfinished planes. A player's unfinished planes are a
+# multiset of codes below FINISH, ranked by multiset_rank into [0, num_multisets). Positions are indexed by
+# (turn * num_multisets + rank of player 0) * num_multisets + rank of player 1, and the table holds player 0's win
+# probability with optimal play as uint16 (1 is 65535).
+COLORS = ('B', 'G')
+HEADER = struct.Struct('<4sBB2sI')  # magic, max planes, codes, colors, multisets
+MAGIC = b'AETB'
+SCALE = 65535
+
+
+def num_multisets(max_planes: int) -> int:
+    return sum(comb(FINISH + k - 1, k) for k in range(max_planes + 1))
+
+
+def multiset_rank(codes: list[int]) -> int:
+    """
+    Perfect hash of a sorted multiset of unfinished plane codes: multisets with fewer planes come first, then the
+    combinatorial number system rank of the set codes[i] + i
+    """
+    k = len(codes)
+    rank = sum(comb(FINISH + j - 1, j) for j in range(k))
+    for i, code in enumerate(codes):
+        rank += comb(code + i, i + 1)
+    return rank
+
+
+def unfinished(planes: tuple[int, ...], player: int) -> list[int]:
+    return sorted(code for code in planes[player * NUM_PLANES:(player + 1) * NUM_PLANES] if code != FINISH)
+
+
+class Tablebase:
+    """
+    Memory mapped endgame table written by build_tablebase
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.max_planes, codes, colors, self.num_multisets = HEADER.unpack_from(self.data)
+        if magic != MAGIC or codes != FINISH or colors.decode() != ''.join(COLORS):
+            raise ValueError(f"{path} is not an endgame table of this engine")
+
+    def index(self, state: GameState):
+        """
+        Table index of state, None when it is not in the table
+        """
+        if state.colors != COLORS:
+            return None
+        ranks = []
+        for player in range(len(COLORS)):
+            codes = unfinished(state.planes, player)
+            if len(codes) > self.max_planes:
+                return None
+            ranks.append(multiset_rank(codes))
+        return (state.turn * self.num_multisets + ranks[0]) * self.num_multisets + ranks[1]
+
+    def win_probability(self, state: GameState, color: str):
+        """
+        Probability that color wins from state with optimal play, None when state is not in the table
+        """
+        index = self.index(state)
+        if index is None:
+            return None
+        p = struct.unpack_from('<H', self.data, HEADER.size + 2 * index)[0] / SCALE
+        return p if color == COLORS[0] else 1 - p
+
+    def close(self):
+        self.data.close()
+
+
+_tablebase = None
+
+
+def get_tablebase():
+    """
+    Table at TABLEBASE_PATH, None if it has not been built or the stacked-plane rule variant is played
+    """
+    global _tablebase
+    if _tablebase is None and not STACK_BLOCKS and os.path.exists(TABLEBASE_PATH):
+        _tablebase = Tablebase(TABLEBASE_PATH)
+    return _tablebase
+
+
+def build_moves(color: str, multisets: list[tuple[int, ...]], max_planes: int):
+    """
+    For each multiset of a color's unfinished planes, die and distinct plane moved (choice): rank of the new multiset
+    (-1 if the choice doesn't exist or can't move) and the catch pattern id, with the patterns as
+    (main track squares, opponent final stretch catch)
+    """
+    ranks = {m: r for r, m in enumerate(multisets)}
+    new_rank = np.full((len(multisets), 7, max_planes), -1, dtype=np.int32)
+    pattern = np.zeros((len(multisets), 7, max_planes), dtype=np.int32)
+    patterns = {((), False): 0}
+    for r, m in enumerate(multisets):
+        for die_v in range(1, 7):
+            for c, code in enumerate(sorted(set(m))):
+                move = MOVE_TABLE[color][code][die_v]
+                if move is None:
+                    continue
+                code2, _, catch_squares, catch_final = move
+                m2 = list(m)
+                m2.remove(code)
+                if code2 != FINISH:
+                    m2.append(code2)
+                new_rank[r, die_v, c] = ranks[tuple(sorted(m2))]
+                pattern[r, die_v, c] = patterns.setdefault((catch_squares, catch_final), len(patterns))
+    return new_rank, pattern, list(patterns)
+
+
+def build_catches(color: str, multisets: list[tuple[int, ...]], patterns: list[tuple]) -> np.ndarray:
+    """
+    Rank of each multiset of color's planes after each catch pattern of its opponent's move
+    """
+    ranks = {m: r for r, m in enumerate(multisets)}
+    caught = np.empty((len(patterns), len(multisets)), dtype=np.int32)
+    for p, (squares, catch_final) in enumerate(patterns):
+        for r, m in enumerate(multisets):
+            m2 = [HANGAR if MAIN_SQUARE[color][code] in squares or (catch_final and code == FINAL_BASE + 3) else code
+                  for code in m]
+            caught[p, r] = ranks[tuple(sorted(m2))]
+    return caught
+
+
+def build_tablebase(max_planes: int = TABLEBASE_PLANES, tolerance: float = 1e-6, max_iterations: int = 10000):
+    """
+    Value iteration of player 0's win probability over all endgames of up to max_planes unfinished planes a side:
+    the player to move averages over the die and picks its best move (player 0 maximizes, player 1 minimizes),
+    a 6 gives another turn and a player without movable planes passes.
+    """
+    assert OPPONENT[COLORS[0]] == COLORS[1] and OPPONENT[COLORS[1]] == COLORS[0]
+    multisets = [m for k in range(max_planes + 1) for m in combinations_with_replacement(range(FINISH), k)]
+    multisets.sort(key=lambda m: multiset_rank(list(m)))
+    assert [multiset_rank(list(m)) for m in multisets] == list(range(len(multisets)))
+    n = len(multisets)
+
+    moves = [build_moves(color, multisets, max_planes) for color in COLORS]
+    # catches[p]: player p's multiset after the other player's move patterns
+    catches = [build_catches(COLORS[p], multisets, moves[1 - p][2]) for p in range(2)]
+
+    # values[turn, rank of player 0, rank of player 1], finished positions stay fixed
+    values = np.full((2, n, n), 0.5)
+    values[:, 0, :] = 1
+    values[:, :, 0] = 0
+    values[:, 0, 0] = 0.5  # Unreachable
+    live = np.ones((n, n), dtype=bool)
+    live[0, :] = False
+    live[:, 0] = False
+
+    for iteration in range(max_iterations):
+        delta = 0
+        for turn in range(2):
+            new_rank, pattern, _ = moves[turn]
+            total = np.zeros((n, n))
+            for die_v in range(1, 7):
+                next_values = values[turn if die_v == 6 else 1 - turn]
+                if turn == 1:  # Index by [mover, other] as for player 0
+                    next_values = next_values.T
+                best = None
+                for c in range(max_planes):
+                    ranks = new_rank[:, die_v, c]
+                    other = catches[1 - turn][pattern[:, die_v, c]]  # [mover, other] -> other's rank
+                    v = next_values[np.maximum(ranks, 0)[:, None], other]
+                    v = np.where((ranks >= 0)[:, None], v, np.nan)
+                    best = v if best is None else (np.fmax(best, v) if turn == 0 else np.fmin(best, v))
+                # No movable plane: pass
+                total += np.where(np.isnan(best), next_values, best)
+            new_values = total / 6
+            if turn == 1:
+                new_values = new_values.T
+            delta = max(delta, np.abs(new_values - values[turn])[live].max())
+            values[turn][live] = new_values[live]
+        if delta < tolerance:
+            break
+    return values, iteration + 1, delta
+
+
+def save_tablebase(path: str, values: np.ndarray, max_planes: int):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, max_planes, FINISH, ''.join(COLORS).encode(), values.shape[1]))
+        f.write(np.round(values * SCALE).astype('<u2').tobytes())
+
+
+def main():
+    parser = ArgumentParser(description="Build the endgame table of positions with few unfinished planes")
+    parser.add_argument('--planes', type=int, default=TABLEBASE_PLANES, help="Most unfinished planes of each player")
+    parser.add_argument('--tolerance', type=float, default=1e-6)
+    parser.add_argument('--output', default=TABLEBASE_PATH)
+    args = parser.parse_args()
+
+    start = time.time()
+    values, iterations, delta = build_tablebase(args.planes, args.tolerance)
+    save_tablebase(args.output, values, args.planes)
+    print(f"{values.size} positions, {iterations} iterations (last change {delta:.2g}) in {time.time() - start:.1f}s, "
+          f"written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
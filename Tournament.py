@@ -0,0 +1,217 @@
+import collections
+import os
+import random
+import tempfile
+import time
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import Agent
+from Agent import AeroplaneChessAgent, QTable, RLAgent
+from Game import Game, AGENTS
+from GameRecord import GameRecorder, GameRecordWriter
+from Instrumentation import HistogramSink, clock
+from utils import PLAYER_COLORS
+
+
+def derive_seed(seed: int, index: int) -> int:
+    """
+    Seed of game index in a tournament, any game can be replayed from it
+    """
+    return random.Random(f"{seed}-{index}").getrandbits(32)
+
+
+def play_game(agents: list[str], seed: int, record: bool = False) -> Game:
+    random.seed(seed)
+    game = Game(num_players=len(agents), agents=agents)
+    if record:
+        game.recorder = GameRecorder(seed, agents, game.state)
+    while not game.is_over:
+        game.player_move()
+    return game
+
+
+def _play_game_task(task):
+    index, agents, seed, record = task
+    start = clock()
+    game = play_game(agents, seed, record)
+    record = game.recorder.finish(game.winner) if record else None
+    # Send back the decision stats of this game only
+    sink = AeroplaneChessAgent.hook
+    if sink is not None:
+        AeroplaneChessAgent.hook = HistogramSink()
+    return index, seed, game.winner, game.decision_time_sum, clock() - start, sink, record
+
+
+def _init_worker(q_table, stats: bool):
+    Agent.Q = q_table
+    # Every game plays from the trained table, whichever games the worker played before
+    RLAgent.learning = False
+    if stats:
+        AeroplaneChessAgent.hook = HistogramSink()
+
+
+def train_rl(agents: list[str], num_games: int, seed: int):
+    """
+    Train the shared Q table with sequential games before the tournament
+    """
+    for i in range(num_games):
+        print(f"Playing {i + 1}th game (Training)...")
+        play_game(agents, derive_seed(seed, -(i + 1)))
+
+
+# Snapshot the worker's Q table was last reset to, self-play deltas are taken against it
+_snapshot = None
+_snapshot_version = None
+
+
+def _load_snapshot(path: str, version: int):
+    global _snapshot, _snapshot_version
+    if version != _snapshot_version:
+        _snapshot = QTable()
+        _snapshot.load(path)
+        _snapshot_version = version
+    Agent.Q.load(path)
+    Agent.Q.changed = set()
+
+
+def _self_play_task(task):
+    path, version, seeds = task
+    _load_snapshot(path, version)
+    for seed in seeds:
+        play_game(['RL', 'RL'], seed)
+    return Agent.Q.changes(_snapshot)
+
+
+def _evaluate_task(task):
+    path, version, seed = task
+    _load_snapshot(path, version)
+    return play_game(['RL', 'Random'], seed).winner == 'B'
+
+
+def train_rl_parallel(num_games: int, seed: int = 0, workers: int = None, sync_games: int = 50,
+                      eval_games: int = 20):
+    """
+    Train the shared Q table with self-play games on a process pool. Every round the learner saves a snapshot
+    of the table, each worker plays sync_games from it and sends back its Q value deltas, which the learner
+    adds to the table before the next snapshot.
+    """
+    workers = workers or os.cpu_count()
+    played = 0
+    version = 0
+    train_time = 0
+    with tempfile.TemporaryDirectory() as tmp, Pool(workers) as pool:
+        path = os.path.join(tmp, 'q_snapshot.bin')
+        while played < num_games:
+            Agent.Q.save(path)
+            version += 1
+            batch = min(sync_games * workers, num_games - played)
+            seeds = [derive_seed(seed, -(played + i + 1)) for i in range(batch)]
+            tasks = [(path, version, seeds[w::workers]) for w in range(workers) if seeds[w::workers]]
+
+            start = time.time()
+            for changes in pool.imap_unordered(_self_play_task, tasks):
+                Agent.Q.merge(changes)
+            train_time += time.time() - start
+            played += batch
+
+            metrics = f"{played} games, {played / train_time:.1f} games/s, {len(Agent.Q)} Q table entries"
+            if eval_games > 0:
+                Agent.Q.save(path)
+                version += 1
+                tasks = [(path, version, derive_seed(seed, -(num_games + played + i + 1))) for i in range(eval_games)]
+                wins = sum(pool.imap_unordered(_evaluate_task, tasks))
+                metrics += f", win rate against Random: {wins / eval_games:.2f}"
+            print(metrics)
+
+
+def prepare_rl(agents: list[str], seed: int, workers: int = None, train_games: int = 0,
+               parallel_training: bool = False, load_q: str = None):
+    """
+    Q table the RL agents play the tournament games with: loaded from load_q, otherwise trained from seed
+    """
+    if 'RL' not in agents:
+        return
+    if load_q is not None:
+        Agent.Q.load(load_q)
+    elif train_games > 0:
+        if parallel_training:
+            train_rl_parallel(train_games, seed, workers)
+        else:
+            train_rl(agents, train_games, seed)
+
+
+def run_tournament(agents: list[str], num_games: int, seed: int = 0, workers: int = None, train_games: int = 0,
+                   parallel_training: bool = False, stats: bool = False, record_path: str = None,
+                   load_q: str = None):
+    prepare_rl(agents, seed, workers, train_games, parallel_training, load_q)
+
+    winner_history = []
+    decision_time_history = {}  # Store total decision time for all games
+    tasks = [(i, agents, derive_seed(seed, i), record_path is not None) for i in range(num_games)]
+    sink = HistogramSink()
+    writer = GameRecordWriter(record_path) if record_path is not None else None
+    with Pool(workers, initializer=_init_worker, initargs=(Agent.Q, stats)) as pool:
+        # Results stream back as games finish
+        for index, game_seed, winner, decision_time_sum, duration, game_sink, record in \
+                pool.imap_unordered(_play_game_task, tasks):
+            print(f"Game {index + 1} (seed {game_seed}) won by {winner}, finish time: {duration}")
+            if game_sink is not None:
+                sink.merge(game_sink)
+            if writer is not None:
+                writer.write_game(record)
+            winner_history.append(winner)
+            for k, v in decision_time_sum.items():
+                decision_time_history[k] = decision_time_history.get(k, []) + [v]
+
+    if writer is not None:
+        writer.close()
+
+    for k, v in decision_time_history.items():
+        decision_time_history[k] = sum(v) / len(v)
+    counter = collections.Counter(winner_history)
+    print("Winner summary:", counter)
+    print("Decision time average:", decision_time_history)
+    if stats:
+        print("Decision stats:")
+        print(sink.report())
+    return counter, decision_time_history
+
+
+def main():
+    parser = ArgumentParser(description="Play a tournament of headless games on a process pool")
+    parser.add_argument('--agent1', default='Expectimax', choices=AGENTS, help="Blue player agent")
+    parser.add_argument('--agent2', default='Random', choices=AGENTS, help="Agent of the other players")
+    parser.add_argument('--players', type=int, default=2, choices=PLAYER_COLORS,
+                        help="Players of each game, colors in turn order: B, G for 2 players, B, Y, G(, R) for more")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--train-games', type=int, default=1000, help="RL training games played before the tournament")
+    parser.add_argument('--parallel-training', action='store_true',
+                        help="Train RL with self-play games on the worker processes")
+    parser.add_argument('--save-q', default=None, help="Save the trained RL Q table to this path")
+    parser.add_argument('--load-q', default=None,
+                        help="Play RL from this saved Q table instead of training, replays of games with parallel "
+                             "training need the table saved with --save-q")
+    parser.add_argument('--stats', action='store_true', help="Report histograms of per-move search statistics")
+    parser.add_argument('--record', default=None, help="Write a binary record of every game to this path")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes, defaults to the number of CPUs")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', type=int, default=None, help="Replay this game index of the tournament")
+    args = parser.parse_args()
+
+    agents = [args.agent1] + [args.agent2] * (args.players - 1)
+    if args.replay is not None:
+        # Same table as the tournament, sequential training is deterministic given the seed
+        prepare_rl(agents, args.seed, args.workers, args.train_games, args.parallel_training, args.load_q)
+        RLAgent.learning = False
+        game = play_game(agents, derive_seed(args.seed, args.replay))
+        print("Winner:", game.winner)
+    else:
+        run_tournament(agents, args.games, args.seed, args.workers, args.train_games, args.parallel_training,
+                       args.stats, args.record, args.load_q)
+        if args.save_q is not None:
+            Agent.Q.save(args.save_q)
+
+
+if __name__ == '__main__':
+    main()
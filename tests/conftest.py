@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The engine modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import random_game  # noqa: E402
+from utils import PLAYER_COLORS  # noqa: E402
+
+
+@pytest.fixture
+def random_games():
+    """
+    random_game of a few seeds for each number of players
+    """
+    def games(seeds: int = 10):
+        for num_players in PLAYER_COLORS:
+            for seed in range(seeds):
+                yield num_players, random_game(num_players, seed)
+    return games
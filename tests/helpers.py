@@ -0,0 +1,21 @@
+import random
+
+from Game import Player
+from GameBoard import GameState
+from utils import PLAYER_COLORS
+
+
+def random_game(num_players: int, seed: int, max_plies: int = 2000):
+    """
+    Yield (state, die, action) of every ply of a seeded game of uniformly random moves, until a player wins
+    """
+    rng = random.Random(seed)
+    state = GameState([Player(color) for color in PLAYER_COLORS[num_players]], 0)
+    for _ in range(max_plies):
+        die_v = rng.randint(1, 6)
+        movable = state.get_movable_planes(die_v)
+        action = rng.choice(movable) if movable else None
+        yield state, die_v, action
+        state = state.generate_successor(action, die_v)
+        if any(state.is_win(color) for color in state.colors):
+            return
@@ -0,0 +1,214 @@
+import random
+
+import numpy as np
+import pytest
+
+import Agent
+from Agent import ExpectimaxAgent, MCTSAgent
+from Frontier import LinearEvaluator
+from GameBoard import GameState, NUM_PLANES, HANGAR, FINISH
+from helpers import random_game
+
+
+@pytest.fixture(autouse=True)
+def no_tables(monkeypatch):
+    # Agents search every position instead of playing it from a table built on this machine
+    monkeypatch.setattr(Agent, 'get_opening_book', lambda: None)
+    monkeypatch.setattr(Agent, 'get_tablebase', lambda: None)
+
+
+def random_positions(num_players: int, count: int, seed: int = 0):
+    """
+    (state, die) decisions of the first player with a choice of moves, sampled from seeded random games
+    """
+    rng = random.Random(seed)
+    positions = []
+    game = 0
+    while len(positions) < count:
+        plies = list(random_game(num_players, seed * 1000 + game))
+        game += 1
+        for state, _, _ in rng.sample(plies, min(len(plies), 5)):
+            state = GameState(state._players, 0, state.planes)
+            die_v = rng.randint(1, 6)
+            if len(state.get_distinct_moves(die_v)) > 1:
+                positions.append((state, die_v))
+    return positions[:count]
+
+
+def search(state: GameState, die_v: int, depth: int, **kwargs):
+    agent = ExpectimaxAgent(state.colors[0], time_limit=None, depth=depth, **kwargs)
+    action = agent.get_action(state, die_v)
+    return action, agent.root_values
+
+
+@pytest.mark.parametrize('num_players', [2, 4])
+@pytest.mark.parametrize('depth', [2, 3])
+def test_pruning_matches_unpruned_search(num_players, depth):
+    for state, die_v in random_positions(num_players, 60 if depth == 2 else 25):
+        action, values = search(state, die_v, depth, pruning=True)
+        exact_action, exact_values = search(state, die_v, depth, pruning=False)
+        best = max(exact_values.values())
+        # Pruned root values are bounds except for the best action, ties may pick another action of the best value
+        assert abs(values[action] - best) < 1e-9
+        assert abs(exact_values[action] - best) < 1e-9
+        assert action == exact_action or abs(exact_values[exact_action] - exact_values[action]) < 1e-9
+
+
+def test_evaluate_matches_evaluate_state(random_games):
+    for num_players, game in random_games():
+        agent = Agent.RandomAgent('B')
+        for state, _, _ in game:
+            assert abs(agent.evaluate(state) - agent.evaluate_state(state)) < 1e-9
+
+
+@pytest.mark.parametrize('weights', [(0, 0, 1, 0), (20000, -10000, 10, 10)])
+def test_custom_evaluator_scores_every_leaf(weights):
+    evaluator = LinearEvaluator(2, weights)
+    for state, die_v in random_positions(2, 15, seed=1):
+        action, values = search(state, die_v, 3, evaluator=evaluator, frontier_depth=2)
+        exact_action, exact_values = search(state, die_v, 3, evaluator=evaluator, frontier_depth=0, pruning=False)
+        assert values.keys() == exact_values.keys()
+        assert all(abs(values[a] - exact_values[a]) <= 1e-9 * max(1.0, abs(exact_values[a])) for a in values)
+
+
+def test_mcts_searches_the_given_die():
+    for state, die_v in random_positions(2, 5, seed=4):
+        random.seed(0)
+        agent = MCTSAgent(state.colors[0], iterations=50)
+        assert state.die_roll is None
+        assert agent.get_action(state, die_v) in state.get_movable_planes(die_v)
+        assert agent.root.state.die_roll == die_v and state.die_roll is None
+
+
+def test_mcts_reuses_tree_for_any_explored_die():
+    state, die_v = random_positions(2, 1, seed=2)[0]
+    random.seed(0)
+    agent = MCTSAgent(state.colors[0], iterations=300)
+    agent.get_action(state, die_v)
+    chance = max(agent.root.children, key=lambda child: child.n)
+    agent.last_action = action = chance.action
+    # Every die drawn after the move has its own subtree, so the search continues from it whatever the real die
+    assert len(chance.children) == 6
+    die_roll = chance.children[2].state.die_roll
+    visits = chance.children[2].n
+    real = state.generate_successor(action, die_v)
+    real.die_roll = die_roll
+    assert agent.reuse_tree(real).n == visits
+
+
+def test_mcts_reuses_tree_in_any_plane_order():
+    for state, die_v in random_positions(2, 20, seed=5):
+        random.seed(0)
+        agent = MCTSAgent(state.colors[0], iterations=300)
+        agent.get_action(state, die_v)
+        chance = max(agent.root.children, key=lambda child: child.n)
+        node = max(chance.children, key=lambda child: len(child.children))
+        real = state.generate_successor(chance.action, die_v)
+        # The same position with every player's planes in reverse order, as if the game moved other planes
+        planes = tuple(code for i in range(len(real.colors))
+                       for code in reversed(real.planes[i * NUM_PLANES:(i + 1) * NUM_PLANES]))
+        if planes == real.planes or len(node.children) < 2:
+            continue
+        real = GameState(real._players, real.turn, planes)
+        real.die_roll = node.state.die_roll
+        agent.last_action = chance.action
+        children = {child.state.zobrist: child.n for child in node.children}
+        root = agent.reuse_tree(real)
+        assert root.n == node.n
+        # Root moves are numbered for the planes of the real state
+        assert {real.generate_successor(child.action, real.die_roll).zobrist: child.n
+                for child in root.children} == children
+        assert all(child.action in real.get_distinct_moves(real.die_roll) for child in root.children)
+        return
+    pytest.fail("No position with planes to reorder")
+
+
+@pytest.mark.parametrize('rollout_policy', ['random', 'greedy'])
+def test_rollout_matches_generate_successor(random_games, rollout_policy):
+    for num_players, game in random_games(seeds=2):
+        for state, _, _ in list(game)[::10]:
+            agent = MCTSAgent(state.colors[0], rollout_plies=None, rollout_policy=rollout_policy)
+            random.seed(num_players)
+            value = agent.simulate(Agent.MCTSNode(state, None))
+
+            # Same rollout through GameState, drawing the same random numbers
+            random.seed(num_players)
+            while not any(state.is_win(color) for color in state.colors):
+                die_v = random.randint(1, 6)
+                movable = state.get_movable_planes(die_v)
+                scores = Agent.PLANE_SCORES[state.colors[state.turn]]
+                start = state.turn * NUM_PLANES
+                action = None
+                if movable and rollout_policy == 'greedy':
+                    action = max(movable, key=lambda i: scores[state.generate_successor(i, die_v).planes[start + i]] -
+                                 scores[state.planes[start + i]])
+                elif movable:
+                    action = random.choice(movable)
+                state = state.generate_successor(action, die_v)
+            assert value == agent.evaluate_planes(state.planes, state.colors)
+
+
+def test_q_table_reads_loaded_file(tmp_path):
+    rng = random.Random(0)
+    path = str(tmp_path / 'q.bin')
+    # Keys of 4 players need two 64 bit words
+    keys = [rng.getrandbits(100) for _ in range(200)]
+    table = Agent.QTable()
+    for key in keys:
+        table.reset(key, [0, 2])
+        table.add(key, 2, key % 7)
+    table.save(path)
+
+    loaded = Agent.QTable(max_entries=10)
+    loaded.load(path)
+    loaded.changed = set()
+    assert len(loaded) == len(keys) and keys[0] in loaded and keys[0] + 1 not in loaded
+    assert all(loaded.value(key, 2) == key % 7 and loaded.best_action(key) == (2 if key % 7 else 0) for key in keys)
+
+    # Written entries are copied from the file, evicted ones fall back to it
+    for key in keys[:50]:
+        loaded.add(key, 0, 1.0)
+    loaded.reset(keys[0] + 1, [1])
+    assert len(loaded) == len(keys) + 1 and len(loaded.slots) == 10
+    assert all(loaded.value(key, 0) == (1.0 if key in loaded.slots else 0.0) and loaded.value(key, 2) == key % 7
+               for key in keys[:50])
+
+    # Deltas of the entries still in the table, added to the file they were taken against, give their values
+    snapshot = Agent.QTable()
+    snapshot.load(path)
+    snapshot.merge(loaded.changes(snapshot))
+    for key in loaded.slots:
+        np.testing.assert_array_equal([snapshot.value(key, a) for a in range(NUM_PLANES)],
+                                      [loaded.value(key, a) for a in range(NUM_PLANES)])
+    loaded.save(path)
+    snapshot.clear()
+    snapshot.load(path)
+    assert len(snapshot) == len(keys) + 1 and snapshot.value(keys[0] + 1, 1) == 0.0
+
+
+def test_paranoid_opponents_play_against_the_agent(random_games):
+    catches = 0
+    for num_players, game in random_games(seeds=3):
+        agent = ExpectimaxAgent('B', time_limit=None, opponents='paranoid')
+        agent.max_depth = 1
+        for state, die_v, _ in game:
+            moves = state.get_distinct_moves(die_v)
+            if state.turn == 0 or len(moves) < 2:
+                continue
+            _, move = agent._search(state, die_v, 1, False, -float('inf'), float('inf'))
+            succs = {a: state.generate_successor(a, die_v).planes for a in moves}
+
+            # The modelled opponent move leaves the agent the lowest score relative to all the other players
+            def score(a):
+                return sum(Agent.PLANE_SCORES[state.colors[i // NUM_PLANES]][code] * (1 if i < NUM_PLANES else -1)
+                           for i, code in enumerate(succs[a]))
+            assert abs(score(move) - min(map(score, moves))) < 1e-9
+
+            # A catch of the agent's planes is taken unless another plane can finish instead
+            def caught(a):
+                return succs[a][:NUM_PLANES].count(HANGAR) > state.planes[:NUM_PLANES].count(HANGAR)
+            finishing = any(succs[a].count(FINISH) > state.planes.count(FINISH) for a in moves)
+            if any(map(caught, moves)) and not finishing:
+                catches += 1
+                assert caught(move)
+    assert catches > 0
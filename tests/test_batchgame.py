@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+import pytest
+
+from BatchGame import BatchGame
+from Game import Player
+from GameBoard import GameState, Plane, NUM_PLANES
+from utils import PLAYER_COLORS
+
+
+@pytest.mark.parametrize('num_players', sorted(PLAYER_COLORS))
+def test_batch_matches_generate_successor(num_players):
+    colors = PLAYER_COLORS[num_players]
+    num_games = 20
+    rng = random.Random(num_players)
+    batch = BatchGame(num_games, colors)
+    states = [GameState([Player(color) for color in colors], 0) for _ in range(num_games)]
+    winners = [-1] * num_games
+
+    for _ in range(3000):
+        if batch.is_over:
+            break
+        dice = np.zeros(num_games, dtype=np.int64)
+        actions = np.full(num_games, -1, dtype=np.int64)
+        games = np.flatnonzero(batch.winner < 0)
+        for g in games:
+            dice[g] = rng.randint(1, 6)
+            movable = states[g].get_movable_planes(dice[g])
+            if movable:
+                actions[g] = rng.choice(movable)
+        movable_masks = batch.movable_planes(games, dice[games])
+
+        batch.step(dice=dice, actions=actions)
+        for k, g in enumerate(games):
+            state = states[g]
+            assert tuple(np.flatnonzero(movable_masks[k])) == state.get_movable_planes(dice[g])
+            state = state.generate_successor(None if actions[g] < 0 else int(actions[g]), int(dice[g]))
+            if state.is_win(colors[states[g].turn]):
+                winners[g] = states[g].turn
+            states[g] = state
+            assert tuple(batch.codes[g].reshape(-1)) == state.planes
+            assert batch.turn[g] == state.turn
+            assert batch.winner[g] == winners[g]
+    assert batch.is_over
+
+    # Finished games dropped back to Python players, whose planes are encoded again by GameState
+    for g in range(3):
+        players = [Player(color) for color in colors]
+        for i, player in enumerate(players):
+            player.planes = [Plane.from_code(player.color, j, int(batch.codes[g, i, j])) for j in range(NUM_PLANES)]
+        assert GameState(players, int(batch.turn[g])) == states[g]
@@ -0,0 +1,48 @@
+from GameBoard import MOVE_TABLE, NUM_CODES, NO_JUMP, JUMP, BIG_JUMP, Plane, Square
+from utils import COLORS, NUM_SQUARES
+
+
+def reference_move(color: str, code: int, die_v: int):
+    """
+    MOVE_TABLE entry resolved with Plane.move and the board squares, as moves were played before the table
+    """
+    plane = Plane.from_code(color, 0, code)
+    if plane.is_finished() or (plane.is_on_hangar() and die_v != 6):
+        return None
+    plane.move(die_v)
+    jump = NO_JUMP
+    catch_squares = []
+    if plane.is_on_main_track():
+        pos = plane.pos
+        catch_squares.append(pos)
+        if Square(pos).color == color:
+            if Square(pos).is_jump_point() or Square((pos + 4) % NUM_SQUARES).is_jump_point():
+                plane.move(16)
+                jump = BIG_JUMP
+            else:
+                plane.move(4)
+                jump = JUMP
+            if plane.is_on_main_track():
+                catch_squares.append(plane.pos)
+    return plane.code, jump, tuple(catch_squares), jump == BIG_JUMP
+
+
+def test_move_table_matches_plane_move():
+    for color in COLORS:
+        for code in range(NUM_CODES):
+            assert Plane.from_code(color, 0, code).code == code
+            for die_v in range(1, 7):
+                assert MOVE_TABLE[color][code][die_v] == reference_move(color, code, die_v), (color, code, die_v)
+
+
+def test_apply_undo_restores_state(random_games):
+    for num_players, game in random_games():
+        for state, die_v, action in game:
+            before = (state.turn, state.planes, state.zobrist, state.components, state.occupancy)
+            successor = state.generate_successor(action, die_v)
+            record = state.apply(action, die_v)
+            assert (state.turn, state.planes, state.zobrist, state.components, state.occupancy) == \
+                   (successor.turn, successor.planes, successor.zobrist, successor.components, successor.occupancy)
+            state.undo(record)
+            assert (state.turn, state.planes, state.zobrist, state.components, state.occupancy) == before
+
@@ -0,0 +1,38 @@
+import random
+
+from Agent import ExpectimaxAgent, MCTSAgent
+from Game import Game
+from GameRecord import GameRecorder, GameRecordReader, GameRecordWriter
+from utils import STACK_BLOCKS, MCTS_MAX_FREE_NODES
+
+
+def test_record_keeps_agent_params(tmp_path):
+    agents = ['Expectimax', 'MCTS', 'Random']
+    random.seed(0)
+    game = Game(num_players=3, agents=agents)
+    players = game.state._players
+    players[0].agent = ExpectimaxAgent('B', time_limit=None, depth=3, frontier_depth=1, opponents='paranoid')
+    players[1].agent = MCTSAgent('Y', iterations=50, workers=1, rollout_plies=None, rollout_policy='greedy')
+    game.recorder = GameRecorder(3, agents, game.state)
+    for _ in range(40):
+        die_v = random.randint(1, 6)
+        movable = game.state.get_movable_planes(die_v)
+        game.apply_move(random.choice(movable) if movable else None, die_v)
+
+    path = str(tmp_path / 'games.agr')
+    with GameRecordWriter(path) as writer:
+        writer.write_game(game.recorder.finish(game.winner))
+    reader = GameRecordReader(path)
+    header = reader.header(0)
+    assert header['agents'] == agents and header['stack_blocks'] == STACK_BLOCKS and header['plies'] == 40
+    assert header['params'][1] == {'iterations': 50, 'workers': 1, 'parallel': players[1].agent.parallel,
+                                   'rollout_plies': None, 'rollout_policy': 'greedy',
+                                   'max_free_nodes': MCTS_MAX_FREE_NODES}
+    assert header['params'][2] == {}
+
+    # Replayed agents are built with the recorded parameters
+    state = reader.state(0, 40)
+    assert state.planes == game.state.planes
+    assert [player.agent.params() for player in state._players] == [player.agent.params() for player in players]
+    assert state._players[0].agent.paranoid and state._players[0].agent.depth == 3
+    reader.close()
@@ -4,17 +4,35 @@ import random
 COLORS = ['R', 'B', 'Y', 'G']
 NUM_SQUARES = 52
 
-# ENTRY = {'R': 39, 'B': 0, 'Y': 13, 'G': 26}
-# FS = {'R': 36, 'B': 49, 'Y': 10, 'G': 23}
-ENTRY = {'B': 0, 'G': 26}
-FS = {'B': 49, 'G': 23}
+ENTRY = {'R': 39, 'B': 0, 'Y': 13, 'G': 26}
+FS = {'R': 36, 'B': 49, 'Y': 10, 'G': 23}
 JUMP_POINT = {'R': 4, 'B': 17, 'Y': 30, 'G': 43}
-OPPONENT = {'R': 'Y', 'B': 'G', 'G': 'B', 'Y': 'R'}
+OPPONENT = {'R': 'Y', 'B': 'G', 'G': 'B', 'Y': 'R'}  # Player whose final stretch the big jump crosses
+# Colors of the players of a game in turn order, by number of players
+PLAYER_COLORS = {2: ('B', 'G'), 3: ('B', 'Y', 'G'), 4: ('B', 'Y', 'G', 'R')}
+STACK_BLOCKS = False  # Rule variant: 2 or more stacked planes can't be caught, planes reaching them bounce back
 MAX_DEPTH = 2
+MOVE_TIME_LIMIT = None  # Seconds per Expectimax move, when set the search deepens iteratively until the deadline
+MAX_ITERATIVE_DEPTH = 8
+TT_MAX_ENTRIES = 500000  # Expectimax transposition table size, least recently used entries are evicted
+EXPECTIMAX_OPPONENTS = 'random'  # 'random': opponents move uniformly at random, 'paranoid': they minimise the value
+FRONTIER_DEPTH = 0  # Expectimax subtrees of at most this many moves are searched as one NumPy batch, 0 to disable
 AGENT1 = "Expectimax"
 # AGENT1 = "MCTS"
 # AGENT1 = "RL"
 # AGENT1 = None
+MCTS_ITERATIONS = 200  # Total MCTS iterations per move, split across workers
+MCTS_WORKERS = 1
+MCTS_PARALLEL = 'root'  # 'root': independent trees per worker, 'leaf': one tree with rollouts batched to workers
+MCTS_ROLLOUT_PLIES = 10  # None to roll out until the game ends
+MCTS_ROLLOUT_POLICY = 'random'  # 'random' or 'greedy' (move with the best plane score gain)
+MCTS_MAX_FREE_NODES = 100000  # Released MCTS nodes each agent keeps for reuse
+Q_MAX_ENTRIES = 1000000  # RL Q table size, entries are evicted with the clock policy
+Q_TABLE_PATH = 'q_table.bin'  # Trained RL Q table, loaded instead of retraining when present
+TABLEBASE_PATH = 'endgame_tablebase.bin'  # Built by Tablebase.py, agents play endgames from it when present
+TABLEBASE_PLANES = 2  # Most unfinished planes per player in the endgame table
+OPENING_BOOK_PATH = 'opening_book.bin'  # Built by OpeningBook.py, agents play early-game decisions from it when present
+OPENING_BOOK_PLIES = 8  # Plies from the start of the game covered by the opening book
 DEBUG_EXPECTIMAX = False
 CONFIG = {
     'no-graphics': True,